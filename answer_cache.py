@@ -0,0 +1,241 @@
+import os
+import re
+import time
+import json
+import atexit
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Canonical form of a query used as the exact-match cache key."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def files_fingerprint(paths):
+    """Cheap fingerprint (path, size, mtime) of the files an answer depends on."""
+    h = hashlib.sha1()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+            )
+        else:
+            files = [path]
+        for f in files:
+            try:
+                st = os.stat(f)
+            except FileNotFoundError:
+                h.update(f"{f}:missing".encode())
+                continue
+            h.update(f"{f}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+class AnswerCache:
+    """
+    Persistent cache of final answers keyed on the normalized query and its embedding.
+
+    Exact normalized matches are served without touching the embedding model; otherwise
+    the most similar cached query of the same language is returned when its cosine
+    similarity reaches `threshold`. Entries are evicted LRU-first once `max_entries`
+    is exceeded and expire after `ttl_seconds`.
+
+    Lookups only read the in-memory entries. Access times and expiries are written to
+    SQLite lazily, together with the next `put` (or `flush`), so a cache hit never waits on disk.
+    """
+
+    def __init__(self, path, max_entries=1000, ttl_seconds=24 * 3600, threshold=0.97):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # guards the in-memory state
+        self._db_lock = threading.Lock()  # guards the connection; never taken while holding _lock
+        self._entries = OrderedDict()  # key -> dict, least recently used first
+        self._touched = set()  # keys whose last_access is not on disk yet
+        self._deleted = set()  # keys removed in memory but not on disk yet
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL with synchronous=NORMAL: a commit appends to the log without an fsync
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, lang TEXT, embedding BLOB, response TEXT, "
+            "book_ids TEXT, created REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT key, lang, embedding, response, book_ids, created, last_access "
+            "FROM answers ORDER BY last_access"
+        ).fetchall()
+        for key, lang, emb, response, book_ids, created, last_access in rows:
+            self._entries[key] = {
+                "lang": lang,
+                "embedding": np.frombuffer(emb, dtype=np.float32) if emb else None,
+                "response": response,
+                "book_ids": book_ids,
+                "created": created,
+                "last_access": last_access,
+            }
+        self._expire(time.time())
+        self.flush()
+
+    def _delete(self, keys):
+        # In memory only; the rows are deleted by the next _persist
+        for key in keys:
+            self._entries.pop(key, None)
+            self._touched.discard(key)
+            self._deleted.add(key)
+
+    def _expire(self, now):
+        stale = [k for k, e in self._entries.items() if now - e["created"] > self.ttl_seconds]
+        self._delete(stale)
+
+    def _touch(self, key, now):
+        entry = self._entries[key]
+        entry["last_access"] = now
+        self._entries.move_to_end(key)
+        self._touched.add(key)
+        return entry["response"], entry["book_ids"]
+
+    def _pending(self):
+        """Under _lock: take the access times and deletions that are not on disk yet."""
+        touched = [(self._entries[k]["last_access"], k) for k in self._touched if k in self._entries]
+        deleted = [(k,) for k in self._deleted]
+        self._touched, self._deleted = set(), set()
+        return touched, deleted
+
+    def _persist(self, touched, deleted, rows=()):
+        with self._db_lock:
+            self._conn.executemany("UPDATE answers SET last_access = ? WHERE key = ?", touched)
+            self._conn.executemany("DELETE FROM answers WHERE key = ?", deleted)
+            self._conn.executemany("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def flush(self):
+        """Write pending access times and deletions to disk."""
+        with self._lock:
+            touched, deleted = self._pending()
+        if touched or deleted:
+            self._persist(touched, deleted)
+
+    def ensure_fingerprint(self, fingerprint):
+        """Drop every entry if the index/chunk files changed since they were cached."""
+        with self._db_lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        if row and row[0] == fingerprint:
+            return
+        with self._lock:
+            if row:
+                print("Answer cache invalidated: index files changed")
+            self._delete(list(self._entries))
+            _, deleted = self._pending()
+        with self._db_lock:
+            self._conn.executemany("DELETE FROM answers WHERE key = ?", deleted)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('fingerprint', ?)", (fingerprint,)
+            )
+            self._conn.commit()
+
+    def get_exact(self, query, lang):
+        """Return (response, book_ids) for an exact normalized match, else None."""
+        key = normalize_query(query)
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is None or entry["lang"] != lang:
+                return None
+            if now - entry["created"] > self.ttl_seconds:
+                self._delete([key])
+                return None
+            self.hits += 1
+            return self._touch(key, now)
+
+    def get_similar(self, embedding, lang):
+        """Return (response, book_ids) of the closest cached query above the threshold, else None."""
+        query_vec = _unit(embedding)
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            best_key, best_sim = None, self.threshold
+            for key, entry in self._entries.items():
+                if entry["lang"] != lang or entry["embedding"] is None:
+                    continue
+                sim = float(np.dot(query_vec, entry["embedding"]))
+                if sim >= best_sim:
+                    best_key, best_sim = key, sim
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.near_hits += 1
+            return self._touch(best_key, now)
+
+    def put(self, query, lang, embedding, response, book_ids):
+        """Store an answer. Commits to SQLite, so async callers should run it in a thread."""
+        key = normalize_query(query)
+        emb = _unit(embedding) if embedding is not None else None
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "lang": lang,
+                "embedding": emb,
+                "response": response,
+                "book_ids": book_ids,
+                "created": now,
+                "last_access": now,
+            }
+            self._entries.move_to_end(key)
+            self._deleted.discard(key)
+            self._touched.discard(key)
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._delete(list(self._entries)[:overflow])
+            touched, deleted = self._pending()
+        row = (key, lang, emb.tobytes() if emb is not None else None, response, book_ids, now, now)
+        self._persist(touched, deleted, [row])
+
+    def clear(self):
+        with self._lock:
+            self._delete(list(self._entries))
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __repr__(self):
+        return f"AnswerCache({json.dumps(self.stats())})"
+
+
+def _unit(vector):
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
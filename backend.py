@@ -1,27 +1,91 @@
 import os
 import torch
 import pandas as pd
-from langchain_community.vectorstores import FAISS
+import numpy as np
+from langchain_community.vectorstores.faiss import dependable_faiss_import
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.retrievers import BM25Retriever
 from langchain.retrievers import EnsembleRetriever
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import queue
+import contextvars
 import time
 import re
-from openai import RateLimitError
 import json
-from langdetect import detect, DetectorFactory
+import functools
+import contextlib
+import collections
+import tiktoken
 import datetime
+from answer_cache import AnswerCache, files_fingerprint, normalize_query
+from llm_scheduler import LLMScheduler, Priority, PRIORITY_USER, PRIORITY_BACKGROUND
+from bm25_index import load_bm25_retriever, file_sha256
+from embedding_cache import CachedEmbeddings
+from vector_index import attach_reranking
+from chunk_store import load_chunk_store, load_faiss_vectorstore
+from support_gate import SupportGate, retrieval_features
+from language_router import LanguageRouter, needs_translation
+from log_sink import LogSink
+from tracing import Trace, current_trace, span, set_usage, metrics as stage_metrics
 
 # Constants
 DATA_PATH = './data/'
 LOG_PATH = './logs/query_log.jsonl'
+LOG_BATCH_SIZE = 64  # entries appended per write
+LOG_FLUSH_INTERVAL = 1.0  # seconds an entry may wait for its batch
+LOG_MAX_BYTES = 50 * 1024 * 1024  # rotate the query log past this size (and daily)
+LOG_BACKUP_COUNT = 30  # compressed rotations kept
+INDEX_NAME = os.environ.get("CHATDBG_INDEX", "faiss_index_openai_3textlarge_copy")  # FAISS index folder, e.g. one built by vector_index.py
+BM25_INDEX_NAME = "bm25_index"  # built offline by bm25_index.py
+CHUNK_STORE_NAME = "chunk_store"  # built offline by chunk_store.py
+CHUNKS_FILE = 'combined_chunks.pkl'
+LID_MODEL_PATH = os.path.join(DATA_PATH, 'lid.176.bin')  # fasttext language identification model
+NEIGHBOR_WINDOW = 1  # chunks added on each side of a hit, within the same document
+TOKEN_ENCODING = "o200k_base"  # tokenizer of the gpt-4.1 / gpt-4o family
+VERIFIER_CONTEXT_TOKENS = 8000  # context budget per verifier call
+ANSWER_CONTEXT_TOKENS = 4000  # context budget per answer sample (sent up to n_consistency times)
+SUPPORT_GATE_PATH = os.path.join(DATA_PATH, 'support_gate.json')  # fitted offline by support_gate.py
+SUPPORT_GATE_AUDIT_RATE = 0.05  # share of gate decisions still checked by the LLM verifier
+# Speculative execution trades tokens for latency: work that may be needed starts before the
+# verifier has decided, and is cancelled if it turns out not to be. Both are off until the latency
+# gain is measured: on the supported path the speculative work is thrown away
+SPECULATIVE_REPHRASE = False  # rephrase and retrieve variants while the original query is verified
+SPECULATIVE_ANSWER = False  # answer from the full context while it is verified (n_consistency answer calls)
+VARIANT_CONCURRENCY = 3  # rephrased variants verified at the same time
+# How answers get the Ben-Gurion style and the user's language:
+#   "two_step"  - style rewrite, then a separate translation call for non-Hebrew queries
+#   "fused"     - one call does both for non-Hebrew queries (Hebrew queries only need the style call)
+#   "in_answer" - the answer prompt itself writes in the style and the user's language, no extra call
+STYLE_MODE = "two_step"
+COALESCE_REQUESTS = True  # identical questions asked while one is being answered share its answer
+ANSWER_CACHE_PATH = './cache/answer_cache.sqlite'
+EMBEDDING_CACHE_PATH = './cache/embedding_cache.sqlite'
+EMBEDDING_CACHE_MEMORY_ENTRIES = 10000
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_TTL = 24 * 3600  # seconds
+ANSWER_CACHE_THRESHOLD = 0.97  # cosine similarity for near-duplicate questions
+# Adaptive: draw CONSISTENCY_INITIAL_SAMPLES first and stop there if they agree, else the rest
+# of n_consistency in one more round. Off until CONSISTENCY_AGREEMENT is calibrated on logged
+# samples (benchmarks/consistency_calibration.py); a disagreeing first round adds a round trip
+ADAPTIVE_CONSISTENCY = False  # False: always draw n_consistency samples and ask the judge
+CONSISTENCY_INITIAL_SAMPLES = 2
+CONSISTENCY_AGREEMENT = 0.6  # mean word-overlap of the most central answer to stop early
+LLM_MAX_CONCURRENCY = 16  # in-flight LLM calls across all sessions
+# Requests / tokens per minute per model, e.g. '{"gpt-4.1": {"rpm": 500, "tpm": 30000}}'. They
+# depend on the OpenAI account's usage tier, so there is no default: unlimited unless configured
+LLM_RATE_LIMITS = json.loads(os.environ.get("CHATDBG_LLM_RATE_LIMITS", "{}"))
+LLM_COMPLETION_ESTIMATE = 500  # tokens reserved per call for the completion
+LLM_PRICES = {  # USD per million prompt / completion tokens, for the per-stage cost metrics
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4o-mini": (0.15, 0.60),
+}
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 api_key = "YOUR-API-KEY"
 os.environ["OPENAI_API_KEY"] = api_key
-DetectorFactory.seed = 0
 
 # Global variables
 data = None
@@ -29,6 +93,9 @@ retriever = None
 answer_prompt = None
 answer_llm = None
 vectorstore = None
+embedding_model = None
+support_gate = None
+answer_cache = None
 rephraser_llm = None
 rephraser_prompt = None
 verifier_prompt = None
@@ -39,31 +106,134 @@ style_prompt = None
 style_llm = None
 translation_llm = None
 translation_prompt = None
+fused_style_prompt = None
+styled_answer_prompt = None
+
+# Component registry state: components are loaded once per process and shared by all sessions
+_components_lock = threading.Lock()
+_swap_lock = threading.Lock()  # held only while the loaded components are swapped or snapshotted
+components_ready = threading.Event()
+components_error = None
+components_fingerprint = None
+_warm_up_lock = threading.Lock()  # guards _warm_up_thread only; never held during a load
+_warm_up_thread = None
+
+# Every LLM call in this module goes through one shared scheduler
+llm_scheduler = LLMScheduler(max_workers=LLM_MAX_CONCURRENCY, limits=LLM_RATE_LIMITS)
+
+stage_metrics.prices.update(LLM_PRICES)
+
+# Language is detected once per request and routes the style/translation stage
+language_router = LanguageRouter(LID_MODEL_PATH)
+
+# Log entry of the request being processed, so nested stages can annotate it
+current_log_entry = contextvars.ContextVar("current_log_entry", default=None)
+
+# The index-bound components a request uses, pinned when it starts: a reload swaps the module
+# globals, and a request must not resolve one load's hits against another load's chunk store
+Components = collections.namedtuple(
+    "Components", ["data", "retriever", "embedding_model", "answer_cache", "support_gate", "fingerprint"]
+)
+current_components = contextvars.ContextVar("current_components", default=None)
 
 # Helper functions
+def snapshot_components():
+    with _swap_lock:
+        return Components(data, retriever, embedding_model, answer_cache, support_gate, components_fingerprint)
+
+
+def request_components():
+    """The components pinned by the current request, or the loaded ones outside of a request."""
+    components = current_components.get()
+    return components if components is not None else snapshot_components()
+
+
+def annotate(key, value):
+    entry = current_log_entry.get()
+    if entry is not None:
+        entry[key] = value
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_event_loop():
+    """The process-wide event loop that runs the async pipeline, started on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="backend-loop", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro):
+    # The LLM clients keep their async HTTP connections bound to one loop, so every
+    # sync caller (e.g. each Streamlit session thread) shares the backend loop
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def model_name(llm):
+    return getattr(llm, "model_name", None) or type(llm).__name__
+
+
+def estimate_tokens(prompt, inputs):
+    # Rough upper bound (Hebrew runs ~3 characters per token), settled against actual usage
+    prompt_chars = len(prompt.template) + sum(len(str(v)) for v in inputs.values())
+    return prompt_chars // 3 + LLM_COMPLETION_ESTIMATE
+
+
+async def invoke_llm(prompt, llm, inputs, priority=PRIORITY_USER, stage="llm"):
+    chain = prompt | llm
+    with span(stage, model_name(llm)) as record:
+        response = await llm_scheduler.run(
+            lambda: chain.ainvoke(inputs),
+            model=model_name(llm),
+            priority=priority,
+            tokens=estimate_tokens(prompt, inputs)
+        )
+        set_usage(record, response)
+    return response
+
+
+_log_sink = None
+_log_sink_lock = threading.Lock()
+
+def get_log_sink():
+    """The background writer of the query log, started on first use."""
+    global _log_sink
+    with _log_sink_lock:
+        if _log_sink is None:
+            _log_sink = LogSink(
+                LOG_PATH,
+                batch_size=LOG_BATCH_SIZE,
+                flush_interval=LOG_FLUSH_INTERVAL,
+                max_bytes=LOG_MAX_BYTES,
+                backup_count=LOG_BACKUP_COUNT
+            )
+    return _log_sink
+
+
 def log_interaction(entry: dict):
-    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-    with open(LOG_PATH, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    # Only an enqueue on the request path; the entry is written in the background
+    get_log_sink().write(entry)
 
 
-def detect_lang_ld(text):
-    try:
-        return detect(text)
-    except:
-        return "unknown"
-        
-def initialize_retriever(index_name, embedding_model):
-    vectorstore = FAISS.load_local(
-        folder_path=index_name,
-        embeddings=embedding_model,
-        allow_dangerous_deserialization=True
-    )
+def initialize_retriever(index_name, embedding_model, documents=None, chunks_sha256=None):
+    documents = data if documents is None else documents
+    # Documents are resolved through the chunk store rather than the pickled FAISS docstore
+    vectorstore = load_faiss_vectorstore(index_name, embedding_model, documents)
+    # Compressed indexes re-rank their first-pass hits with memory-mapped full vectors
+    vectorstore = attach_reranking(vectorstore, index_name)
 
     embeddings_retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
 
-    bm25_retriever = BM25Retriever.from_documents(data)
-    bm25_retriever.k = 10
+    bm25_retriever = load_bm25_retriever(
+        BM25_INDEX_NAME, documents, os.path.join(DATA_PATH, CHUNKS_FILE), k=10, source_sha256=chunks_sha256
+    )
+    if bm25_retriever is None:
+        bm25_retriever = BM25Retriever.from_documents(documents)
+        bm25_retriever.k = 10
 
     hybrid_retriever = EnsembleRetriever(
         retrievers=[embeddings_retriever, bm25_retriever],
@@ -73,40 +243,50 @@ def initialize_retriever(index_name, embedding_model):
 
 
 def initialize_llm():
+    # max_retries=0: the SDK would retry and sleep while holding the scheduler slot; LLMScheduler retries
     answer_llm = ChatOpenAI(
         model="gpt-4.1",
         openai_api_key=api_key,
+        max_retries=0,
         top_p = 1,
         temperature = 0.7
         )
     rephraser_llm = ChatOpenAI(model="gpt-4.1",
         openai_api_key=api_key,
+        max_retries=0,
         top_p = 1,
         temperature = 0.5
         )
     verifier_llm = ChatOpenAI(
         model="gpt-4.1",
         openai_api_key=api_key,
+        max_retries=0,
         top_p = 1,
         temperature = 0
         )
     judge_llm = ChatOpenAI(
         model="gpt-4.1",
         openai_api_key=api_key,
+        max_retries=0,
         top_p = 1,
         temperature = 0
         )
+    # The final stage may be streamed; stream_usage reports its tokens for the stage metrics
     translation_llm = ChatOpenAI(
         model="gpt-4o-mini",
         openai_api_key=api_key,
+        max_retries=0,
         top_p = 1,
-        temperature = 0.5
+        temperature = 0.5,
+        stream_usage=True
         )
     style_llm = ChatOpenAI(
         model="gpt-4.1-mini", # This is not the fine-tuned model, but it should be
         top_p=1.0,
         temperature=0.75,
-        openai_api_key=api_key
+        openai_api_key=api_key,
+        max_retries=0,
+        stream_usage=True
         )
     answer_prompt = PromptTemplate(
         input_variables=["query", "context"],
@@ -152,40 +332,76 @@ def initialize_llm():
         """
         )
 
-   style_prompt = PromptTemplate(
-    input_variables=["input"],
-    template=("""
-    אתה עוזר לשוני שתפקידו לשכתב טקסטים הכתובים בעברית יומיומית, פשוטה וברורה, לעברית רשמית בסגנון 'בן-גוריוני'.
-    """
-             )
-                
+    style_prompt = PromptTemplate(
+        input_variables=["input"],
+        template=("""
+        אתה עוזר לשוני שתפקידו לשכתב טקסטים הכתובים בעברית יומיומית, פשוטה וברורה, לעברית רשמית בסגנון 'בן-גוריוני'.
+        """
+        ))
+
     translation_prompt = PromptTemplate(
-    input_variables=["user_language", "input"],
-    template=("""
-        (prompt is complex)
+        input_variables=["user_language", "input"],
+        template=("""
+            (prompt is complex)
+            """
+        ))
+
+    fused_style_prompt = PromptTemplate(
+        input_variables=["user_language", "input"],
+        template=("""
+        אתה עוזר לשוני שתפקידו לשכתב טקסטים הכתובים בעברית יומיומית, פשוטה וברורה, לסגנון 'בן-גוריוני' רשמי.
+        Write the rewritten text in the language with ISO code '{user_language}', keeping Ben-Gurion's formal register and Hebrew names and terms.
+        Return only the rewritten text.
+
+        {input}
         """
-    ))
-    return answer_prompt, answer_llm, rephraser_prompt, rephraser_llm, verifier_prompt, verifier_llm, judge_prompt, judge_llm, style_prompt, style_llm, translation_prompt, translation_llm
+        ))
+
+    styled_answer_prompt = PromptTemplate(
+        input_variables=["query", "context", "user_language"],
+        template=(
+            """
+            You are an AI embodiment of 'דוד בן גוריון' (David Ben-Gurion), the first Prime Minister of Israel. Your task is to respond to user queries as if you were Ben-Gurion himself, drawing from your speeches, diary entries, and historical knowledge.
+            Write in Ben-Gurion's formal style, in the language with ISO code '{user_language}'.
+            (prompt is more complex)
+            """
+        )
+    )
+    return answer_prompt, answer_llm, rephraser_prompt, rephraser_llm, verifier_prompt, verifier_llm, judge_prompt, judge_llm, style_prompt, style_llm, translation_prompt, translation_llm, fused_style_prompt, styled_answer_prompt
 
 # --- Get context for a given document ID (and neighbors from same source) ---
-def get_context_with_neighbors(idx, data):
-    current_doc = data[idx]
-    match_value = current_doc.metadata.get("source")
-    book_id = current_doc.metadata.get("book_id")
-    
-    combined_chunks = []
-    for neighbor_idx in [idx]:  # Can be extended to idx ± 1 etc.
-        if 0 <= neighbor_idx < len(data):
-            neighbor_doc = data[neighbor_idx]
-            if neighbor_doc.metadata.get("source") == match_value:
-                combined_chunks.append(neighbor_doc.page_content)
-
-    return "\n".join(combined_chunks), book_id
+def get_context_with_neighbors(idx, data, window=NEIGHBOR_WINDOW):
+    row = data.row_of(idx)
+    lo, hi = data.window(row, window)
+    return data.span_text(lo, hi), data.value("book_id", row)
+
+def merge_neighbor_spans(rows, data, window=NEIGHBOR_WINDOW):
+    """
+    Expand hit rows to their neighbors and merge overlapping or adjacent windows of the same
+    document, so no chunk is sent twice. Spans are [lo, hi) row ranges, ordered by their best hit.
+    """
+    by_document = {}
+    for rank, row in enumerate(rows):
+        lo, hi = data.window(row, window)
+        by_document.setdefault(int(data.doc_start[row]), []).append((lo, hi, rank))
+
+    spans = []
+    for windows in by_document.values():
+        windows.sort()
+        current = list(windows[0])
+        for lo, hi, rank in windows[1:]:
+            if lo <= current[1]:
+                current[1] = max(current[1], hi)
+                current[2] = min(current[2], rank)
+            else:
+                spans.append(current)
+                current = [lo, hi, rank]
+        spans.append(current)
+    return [(lo, hi) for lo, hi, _ in sorted(spans, key=lambda span: span[2])]
 
 # --- Generate variants of the query ---
-def generate_queries(original_query):
-    chain = rephraser_prompt | rephraser_llm
-    output = chain.invoke({"question": original_query})
+async def generate_queries_async(original_query, priority=PRIORITY_USER):
+    output = await invoke_llm(rephraser_prompt, rephraser_llm, {"question": original_query}, priority, stage="generate_queries")
     text_output = output.content
 
     queries = [
@@ -196,27 +412,141 @@ def generate_queries(original_query):
     print(queries)
     return queries
 
+def generate_queries(original_query):
+    return run_sync(generate_queries_async(original_query))
+
 # --- Retrieve relevant context and doc IDs ---
-def retrieve_contexts(query):
-    context_docs = retriever.invoke(query)
+def build_context(context_docs, data):
     retrieved_ids = [doc.metadata['idx'] for doc in context_docs]
     retrieved_bids = [doc.metadata['book_id'] for doc in context_docs]
+    rows = [data.row_of(idx) for idx in retrieved_ids]
     full_chunks = []
-    for idx in retrieved_ids:
-        chunk_text, book_id = get_context_with_neighbors(idx, data)
-        book_id_str = str(book_id)
-        full_chunk = f"[Book ID: {book_id_str}]\n{chunk_text}"
+    for lo, hi in merge_neighbor_spans(rows, data):
+        book_id_str = str(data.value("book_id", lo))
+        full_chunk = f"[Book ID: {book_id_str}]\n{data.span_text(lo, hi)}"
         full_chunks.append(full_chunk)
 
-    full_context = "\n\n".join(full_chunks)
-    return full_context, retrieved_bids
+    # Blocks in relevance order; each stage packs them into its own token budget
+    return full_chunks, retrieved_bids
+
+# --- Token-budgeted context packing ---
+_encoding = None
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            print(f"Could not load the {TOKEN_ENCODING} tokenizer ({e}), estimating token counts")
+            _encoding = False
+    return _encoding
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text):
+    encoding = get_encoding()
+    return len(encoding.encode(text, disallowed_special=())) if encoding else len(text) // 3
+
+def truncate_to_tokens(text, max_tokens):
+    encoding = get_encoding()
+    if encoding:
+        text = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    else:
+        text = text[:max_tokens * 3]
+    # Drop the word that was cut in the middle
+    return text.rsplit(" ", 1)[0]
+
+def pack_context(context_blocks, max_tokens, stage):
+    """
+    Join context blocks in relevance order until `max_tokens` is reached; the first block that
+    does not fit is cut to the remaining budget. The tokens used are added to the log entry.
+    """
+    packed, used = [], 0
+    separator = count_tokens("\n\n")
+    for block in context_blocks:
+        separator_cost = separator if packed else 0
+        cost = count_tokens(block) + separator_cost
+        if max_tokens is not None and used + cost > max_tokens:
+            remaining = max_tokens - used - separator_cost
+            block = truncate_to_tokens(block, remaining) if remaining > 0 else ""
+            if block:
+                packed.append(block)
+                used += count_tokens(block) + separator_cost
+            break
+        packed.append(block)
+        used += cost
+
+    entry = current_log_entry.get()
+    if entry is not None:
+        entry["context_tokens"][stage] = entry["context_tokens"].get(stage, 0) + used
+    return "\n\n".join(packed)
+
+async def retrieve_contexts_async(query):
+    return (await retrieve_contexts_batch_async([query]))[0]
+
+def retrieve_contexts(query):
+    return run_sync(retrieve_contexts_async(query))
+
+# --- Same retrieval for several queries at once: one embedding request, one FAISS search ---
+def search_vectors(vectorstore, vectors, k):
+    # Mirrors FAISS.similarity_search_by_vector, for a matrix of query vectors; also returns
+    # the top hit's similarity (vectors are unit length, so cos = 1 - squared L2 / 2)
+    faiss = dependable_faiss_import()
+    with span("faiss"):
+        matrix = np.array(vectors, dtype=np.float32)
+        if vectorstore._normalize_L2:
+            faiss.normalize_L2(matrix)
+        distances, indices = vectorstore.index.search(matrix, k)
+        docs = [
+            [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in row if i != -1]
+            for row in indices
+        ]
+    if vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        top_sims = distances[:, 0]
+    else:
+        top_sims = 1 - distances[:, 0] / 2
+    return docs, [float(sim) for sim in top_sims]
+
+def search_bm25(bm25_retriever, queries):
+    with span("bm25"):
+        if hasattr(bm25_retriever, "get_scored_documents_batch"):
+            scored = bm25_retriever.get_scored_documents_batch(queries)
+            return [[doc for doc, _ in hits] for hits in scored], [hits[0][1] if hits else 0.0 for hits in scored]
+        docs = [bm25_retriever.invoke(q) for q in queries]
+        top_scores = [float(np.max(bm25_retriever.vectorizer.get_scores(bm25_retriever.preprocess_func(q)))) for q in queries]
+        return docs, top_scores
+
+async def retrieve_contexts_batch_async(queries):
+    """[(context_blocks, retrieved_bids, retrieval_features)] per query."""
+    queries = list(queries)
+    if not queries:
+        return []
+    components = request_components()
+    embeddings_retriever, bm25_retriever = components.retriever.retrievers
+    vectorstore = embeddings_retriever.vectorstore
+    with span("retrieve_contexts"):
+        with span("embedding"):
+            vectors = await vectorstore.embedding_function.aembed_documents(queries)
+        (faiss_docs, faiss_sims), (bm25_docs, bm25_tops) = await asyncio.gather(
+            asyncio.to_thread(search_vectors, vectorstore, vectors, embeddings_retriever.search_kwargs["k"]),
+            asyncio.to_thread(search_bm25, bm25_retriever, queries)
+        )
+        with span("build_context"):
+            return [
+                (*build_context(components.retriever.weighted_reciprocal_rank([f_docs, b_docs]), components.data),
+                 retrieval_features(sim, top, len(q.split())))
+                for q, f_docs, b_docs, sim, top in zip(queries, faiss_docs, bm25_docs, faiss_sims, bm25_tops)
+            ]
+
+def retrieve_contexts_batch(queries):
+    return run_sync(retrieve_contexts_batch_async(queries))
 
 # --- Check if the context supports the query ---
-def is_supported_by_context(query, context):
-    result = (verifier_prompt | verifier_llm).invoke({
+async def is_supported_by_context_async(query, context, priority=PRIORITY_USER):
+    result = (await invoke_llm(verifier_prompt, verifier_llm, {
         "query": query,
         "context": context
-    }).content.strip()
+    }, priority, stage="verifier")).content.strip()
     # Parse expected format:
     # Support level: Partial support
     # Relevant quotes (if any):
@@ -229,140 +559,517 @@ def is_supported_by_context(query, context):
         return support_level, quote_texts, book_ids
     else:
         return None
-    
+
+def is_supported_by_context(query, context):
+    return run_sync(is_supported_by_context_async(query, context))
+
+# --- Verification, skipped when the retrieval scores already make the outcome clear ---
+async def verify_support_async(user_query, query, context_blocks, features, priority=PRIORITY_USER):
+    support_gate = request_components().support_gate
+    decision = support_gate.decide(features) if support_gate else None
+    record = {"query": query, **features, "gate": decision, "verifier": None}
+    entry = current_log_entry.get()
+    if entry is not None:
+        entry["verifications"].append(record)
+    if decision is not None and not support_gate.should_audit():
+        support_gate.record(decision)
+        return decision, [], []
+
+    result = await is_supported_by_context_async(
+        user_query, pack_context(context_blocks, VERIFIER_CONTEXT_TOKENS, "verifier"), priority
+    )
+    record["verifier"] = result[0] if result else None
+    if decision is not None:
+        support_gate.record(decision, record["verifier"])
+    return result
+
+# --- Cheap agreement measure between sampled answers ---
+def answer_similarity(a, b):
+    words_a, words_b = set(a.lower().split()), set(b.lower().split())
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+def consensus(answers):
+    """Index of the most central answer and its mean similarity to the others."""
+    if len(answers) == 1:
+        return 0, 1.0
+    best_idx, best_score = 0, -1.0
+    for i, ans in enumerate(answers):
+        score = sum(answer_similarity(ans, other) for j, other in enumerate(answers) if j != i) / (len(answers) - 1)
+        if score > best_score:
+            best_idx, best_score = i, score
+    return best_idx, best_score
 
 # --- Perform self-consistency to get the most robust answer ---
-def get_consistent_answer(query, context_text, n_consistency=5):
-    def single_call(_):
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                return (answer_prompt | answer_llm).invoke({
-                    "query": query,
-                    "context": context_text
-                }).content.strip()
-            except RateLimitError:
-                if attempt < max_retries - 1:
-                    time.sleep(5)
-                else:
-                    raise
-
-    with ThreadPoolExecutor() as executor:
-        answers = list(executor.map(single_call, range(n_consistency)))
+async def get_consistent_answer_async(query, context_text, n_consistency=5, adaptive=None, priority=PRIORITY_USER, lang=None):
+    if STYLE_MODE == "in_answer":
+        prompt, inputs = styled_answer_prompt, {
+            "query": query,
+            "context": context_text,
+            "user_language": output_language(lang or language_router.detect(query))
+        }
+    else:
+        prompt, inputs = answer_prompt, {"query": query, "context": context_text}
+
+    async def single_call():
+        return (await invoke_llm(prompt, answer_llm, inputs, priority, stage="answer_sample")).content.strip()
+
+    async def sample(n):
+        return list(await asyncio.gather(*(single_call() for _ in range(n))))
+
+    if adaptive is None:
+        adaptive = ADAPTIVE_CONSISTENCY
+    initial = min(CONSISTENCY_INITIAL_SAMPLES, n_consistency)
+
+    if adaptive:
+        # Only pay for the remaining samples (and the judge) when the first round disagrees.
+        # They are drawn in one round, so disagreement costs one extra round trip, not several
+        answers = await sample(initial)
+        chosen_index, agreement = consensus(answers)
+        annotate("consistency_agreement", round(agreement, 4))
+        if agreement >= CONSISTENCY_AGREEMENT:
+            annotate("consistency_samples", len(answers))
+            annotate("judge_called", False)
+            return answers[chosen_index]
+        answers += await sample(n_consistency - len(answers))
+    else:
+        answers = await sample(n_consistency)
+        # What the adaptive mode would have seen, logged to calibrate CONSISTENCY_AGREEMENT
+        annotate("consistency_agreement", round(consensus(answers[:initial])[1], 4))
+    annotate("consistency_samples", len(answers))
 
     if len(set(answers)) == 1:
+        annotate("judge_called", False)
         return answers[0]
 
+    annotate("judge_called", True)
     formatted_answers = "\n\n".join([
         f"Answer {i+1}:\n{ans}" for i, ans in enumerate(answers)
     ])
 
-    judge_output = (judge_prompt | judge_llm).invoke({
+    judge_output = (await invoke_llm(judge_prompt, judge_llm, {
         "query": query,
         "context": context_text,
         "answers": formatted_answers
-    }).content.strip()
+    }, priority, stage="judge")).content.strip()
 
     match = re.search(r"Answer\s*(\d+)", judge_output)
     if match:
         chosen_index = int(match.group(1)) - 1
         if 0 <= chosen_index < len(answers):
+            annotate("judge_choice", chosen_index)
             return answers[chosen_index]
 
     return answers[0]
 
-def translate_response(query, text):
-    style_chain = style_prompt | style_llm
-    response = style_chain.invoke({"input": text})
+def get_consistent_answer(query, context_text, n_consistency=5, adaptive=None, lang=None):
+    return run_sync(get_consistent_answer_async(query, context_text, n_consistency, adaptive, lang=lang))
+
+def output_language(lang):
+    return lang if needs_translation(lang) else "he"
 
-    lang = detect_lang_ld(query)
+async def translate_response_async(query, text, lang=None):
+    lang = lang or language_router.detect(query)
     print(f"Detected language: {lang}")
-    if lang != "he":
-        translation_chain = translation_prompt | translation_llm
-        trans_response = translation_chain.invoke({"input": response})
+    if STYLE_MODE == "in_answer":
+        # The answers were already written in the style and the user's language
+        return text.strip()
+    if STYLE_MODE == "fused" and needs_translation(lang):
+        response = await invoke_llm(fused_style_prompt, style_llm, {"user_language": lang, "input": text}, stage="style_translation")
+        return response.content.strip()
+
+    response = await invoke_llm(style_prompt, style_llm, {"input": text}, stage="style")
+    if needs_translation(lang):
+        trans_response = await invoke_llm(translation_prompt, translation_llm, {
+            "user_language": lang,
+            "input": response.content
+        }, stage="translation")
     else:
         trans_response = response
 
     return trans_response.content.strip()
 
-# --- Main function: pipeline to process query and return final answer ---
-def answer_query(user_query, to_print=False):
-    log_entry = {
+def translate_response(query, text, lang=None):
+    return run_sync(translate_response_async(query, text, lang))
+
+# --- Streaming variant: only the last LLM call of the stage is streamed ---
+async def translate_response_stream_async(query, text, lang=None):
+    lang = lang or language_router.detect(query)
+    print(f"Detected language: {lang}")
+    if STYLE_MODE == "in_answer":
+        yield text.strip()
+        return
+    if STYLE_MODE == "fused" and needs_translation(lang):
+        final_stage, final_prompt, final_llm, final_input = "style_translation", fused_style_prompt, style_llm, {"user_language": lang, "input": text}
+    elif needs_translation(lang):
+        response = await invoke_llm(style_prompt, style_llm, {"input": text}, stage="style")
+        final_stage, final_prompt, final_llm, final_input = "translation", translation_prompt, translation_llm, {
+            "user_language": lang,
+            "input": response.content
+        }
+    else:
+        final_stage, final_prompt, final_llm, final_input = "style", style_prompt, style_llm, {"input": text}
+
+    # A stream can't be replayed transparently, so it only holds a slot without retries
+    with span(final_stage, model_name(final_llm)) as record:
+        async with llm_scheduler.slot(model_name(final_llm), PRIORITY_USER, estimate_tokens(final_prompt, final_input)):
+            async for chunk in (final_prompt | final_llm).astream(final_input):
+                set_usage(record, chunk)
+                if chunk.content:
+                    yield chunk.content
+
+# --- Look up a previous answer to the same (or a near-duplicate) question ---
+async def get_cached_answer_async(user_query, lang):
+    """Returns ((final_response, book_ids) or None, query embedding or None)."""
+    components = request_components()
+    if components.answer_cache is None:
+        return None, None
+    with span("answer_cache"):
+        hit = components.answer_cache.get_exact(user_query, lang)
+        if hit is not None:
+            return hit, None
+        embedding = await components.embedding_model.aembed_query(user_query)
+        return components.answer_cache.get_similar(embedding, lang), embedding
+
+def new_log_entry(user_query):
+    # Starts the request's trace (its spans are logged with the entry) and pins its components
+    trace = Trace()
+    current_trace.set(trace)
+    current_components.set(snapshot_components())
+    with span("language_detection"):
+        query_language = language_router.detect(user_query)
+    return {
         "timestamp": datetime.datetime.now().isoformat(),
         "original_query": user_query,
-        "query_language": detect_lang_ld(user_query),
+        "query_language": query_language,
+        "style_mode": STYLE_MODE,
         "rephrased_queries": [],
         "used_query": user_query,
         "support_level": None,
         "book_ids": [],
         "pre_translated_answer": None,
-        "final_answer": None
+        "final_answer": None,
+        "cache_hit": False,
+        "time_to_first_token": None,
+        "consistency_samples": None,
+        "consistency_agreement": None,
+        "judge_called": None,
+        "judge_choice": None,
+        "context_tokens": {},
+        "verifications": [],
+        "speculation": {},
+        "evaluated_variants": [],
+        "coalesced": False,
+        "spans": trace.spans
     }
-    # First try the original query
-    context_text, retrieved_bids = retrieve_contexts(user_query)
-    support_level, quotes, book_ids = is_supported_by_context(user_query, context_text)
 
-    log_entry["support_level"] = support_level
+# --- Speculative work runs as a task with its own scratch log entry, merged in only if used ---
+# Its LLM calls go in at background priority, so under load they never delay the calls of
+# requests that are certainly needed; once adopted, whatever is still queued is raised to user priority
+def speculate(coro_fn, *args):
+    parent = current_trace.get()
+    trace = Trace(parent.start if parent else None)
+    scratch = {"context_tokens": {}, "verifications": [], "spans": trace.spans}
+    priority = Priority(PRIORITY_BACKGROUND)
 
-    if support_level == "Strong support":
-        response = get_consistent_answer(user_query, quotes)
-        context_display = "\n".join(quotes)
-        returned_bids = book_ids
-        log_entry["book_ids"] = book_ids
+    async def run():
+        current_log_entry.set(scratch)
+        current_trace.set(trace)
+        return await coro_fn(*args, priority=priority)
 
-    elif support_level == "Partial support":
-        response = get_consistent_answer(user_query, context_text)
-        context_display = context_text
-        returned_bids = retrieved_bids
-        log_entry["book_ids"] = retrieved_bids
+    task = asyncio.create_task(run())
+    # A discarded task's errors are of no interest
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task, scratch, priority
+
+async def adopt(speculative, log_entry):
+    task, scratch, priority = speculative
+    llm_scheduler.raise_priority(priority, PRIORITY_USER)
+    result = await task
+    for stage, tokens in scratch.pop("context_tokens").items():
+        log_entry["context_tokens"][stage] = log_entry["context_tokens"].get(stage, 0) + tokens
+    log_entry["verifications"].extend(scratch.pop("verifications"))
+    log_entry["spans"].extend(scratch.pop("spans"))
+    log_entry.update(scratch)
+    return result
+
+async def rephrase_and_retrieve_async(user_query, priority=PRIORITY_USER):
+    queries = await generate_queries_async(user_query, priority)
+    return queries, await retrieve_contexts_batch_async(queries)
+
+def start_variant_verifications(user_query, queries, variant_contexts):
+    """Verification tasks for the variants in list order, at most VARIANT_CONCURRENCY running at once."""
+    semaphore = asyncio.Semaphore(VARIANT_CONCURRENCY)
+
+    async def verify(q, context_blocks, features):
+        async with semaphore:
+            return await verify_support_async(user_query, q, context_blocks, features)
+
+    return [
+        asyncio.create_task(verify(q, context_blocks, features))
+        for q, (context_blocks, _, features) in zip(queries, variant_contexts)
+    ]
+
+async def answer_from_context_async(user_query, context_blocks, lang=None, priority=PRIORITY_USER):
+    context_text = pack_context(context_blocks, ANSWER_CONTEXT_TOKENS, "answer")
+    return context_text, await get_consistent_answer_async(user_query, context_text, priority=priority, lang=lang)
+
+# --- Retrieval, verification and answering, up to the answer before style/translation ---
+async def prepare_answer_async(user_query, log_entry):
+    current_log_entry.set(log_entry)
+    lang = log_entry["query_language"]
+    speculative = {}
+    variant_verifications = []
+    if SPECULATIVE_REPHRASE:
+        speculative["rephrase"] = speculate(rephrase_and_retrieve_async, user_query)
+    try:
+        # First try the original query
+        context_blocks, retrieved_bids, features = await retrieve_contexts_async(user_query)
+        if SPECULATIVE_ANSWER:
+            speculative["answer"] = speculate(answer_from_context_async, user_query, context_blocks, lang)
+        support_level, quotes, book_ids = await verify_support_async(user_query, user_query, context_blocks, features)
+
+        log_entry["support_level"] = support_level
+
+        if support_level == "Strong support" and quotes:
+            response = await get_consistent_answer_async(user_query, quotes, lang=lang)
+            context_display = "\n".join(quotes)
+            returned_bids = book_ids
+            log_entry["book_ids"] = book_ids
+
+        elif support_level in ("Strong support", "Partial support"):
+            # Also a Strong verdict from the score gate, which has no quotes
+            if "answer" in speculative:
+                log_entry["speculation"]["answer"] = "used"
+                context_text, response = await adopt(speculative.pop("answer"), log_entry)
+            else:
+                context_text, response = await answer_from_context_async(user_query, context_blocks, lang)
+            context_display = context_text
+            returned_bids = retrieved_bids
+            log_entry["book_ids"] = retrieved_bids
 
-    else:
-        # No support – try query variants
-        queries = generate_queries(user_query)
-        log_entry["rephrased_queries"] = queries
-
-        for q in queries:
-            context_text, retrieved_bids = retrieve_contexts(q)
-            support_level, quotes, book_ids = is_supported_by_context(user_query, context_text)
-
-            if support_level == "Strong support":
-                response = get_consistent_answer(user_query, quotes)
-                context_display = "\n".join(quotes)
-                returned_bids = book_ids
-                log_entry.update({
-                    "support_level": support_level,
-                    "used_query": q,
-                    "book_ids": book_ids
-                })
-                break
-
-            elif support_level == "Partial support":
-                response = get_consistent_answer(user_query, context_text)
-                context_display = context_text
-                returned_bids = retrieved_bids
-                log_entry.update({
-                    "support_level": support_level,
-                    "used_query": q,
-                    "book_ids": retrieved_bids
-                })
-                break
         else:
-            # No support found at all
-            response = get_consistent_answer(user_query, "")
-            returned_bids = []
+            # No support – try query variants
+            if "rephrase" in speculative:
+                log_entry["speculation"]["rephrase"] = "used"
+                queries, variant_contexts = await adopt(speculative.pop("rephrase"), log_entry)
+            else:
+                queries, variant_contexts = await rephrase_and_retrieve_async(user_query)
+            log_entry["rephrased_queries"] = queries
+
+            # Variants are verified concurrently but decided in list order, so the earliest
+            # supported variant still wins; later verifications are cancelled once it is found
+            variant_verifications = start_variant_verifications(user_query, queries, variant_contexts)
+            for q, (context_blocks, retrieved_bids, features), verification in zip(queries, variant_contexts, variant_verifications):
+                support_level, quotes, book_ids = await verification
+                log_entry["evaluated_variants"].append({"query": q, "support_level": support_level})
+                if support_level in ("Strong support", "Partial support"):
+                    for task in variant_verifications:
+                        task.cancel()
+
+                if support_level == "Strong support" and quotes:
+                    response = await get_consistent_answer_async(user_query, quotes, lang=lang)
+                    context_display = "\n".join(quotes)
+                    returned_bids = book_ids
+                    log_entry.update({
+                        "support_level": support_level,
+                        "used_query": q,
+                        "book_ids": book_ids
+                    })
+                    break
+
+                elif support_level in ("Strong support", "Partial support"):
+                    context_display, response = await answer_from_context_async(user_query, context_blocks, lang)
+                    returned_bids = retrieved_bids
+                    log_entry.update({
+                        "support_level": support_level,
+                        "used_query": q,
+                        "book_ids": retrieved_bids
+                    })
+                    break
+            else:
+                # No support found at all
+                response = await get_consistent_answer_async(user_query, "", lang=lang)
+                returned_bids = []
+                context_display = ""
+    finally:
+        for name, (task, _, _) in speculative.items():
+            task.cancel()
+            log_entry["speculation"][name] = "discarded"
+        for task in variant_verifications:
+            task.cancel()
 
     log_entry["pre_translated_answer"] = response
-    final_response = translate_response(user_query, response)
-    log_entry["final_answer"] = final_response
+    return response, returned_bids, context_display
 
-    # Success case
-    if to_print:
-        print(f"User's Question: {user_query}\nFinal Answer: {final_response}")
-        print("\nContext:\n", context_display)
-        
+async def finish_answer_async(user_query, log_entry, query_embedding, final_response, returned_bids):
+    log_entry["final_answer"] = final_response
     log_interaction(log_entry)
 
-    return final_response, (", ".join(str(bid) for bid in returned_bids))
+    returned_bids = ", ".join(str(bid) for bid in returned_bids)
+    components = request_components()
+    # An answer from before a reload is not cached under the new index
+    if components.answer_cache is not None and components.fingerprint == components_fingerprint:
+        # The SQLite commit runs off the backend loop, which serves every session
+        await asyncio.to_thread(
+            components.answer_cache.put, user_query, log_entry["query_language"], query_embedding, final_response, returned_bids
+        )
+    return returned_bids
+
+# --- Single flight: identical in-flight questions (same normalized text and language) share one run ---
+_inflight = {}  # only touched from the backend loop
+
+def inflight_key(user_query, lang):
+    return normalize_query(user_query), lang, STYLE_MODE
+
+@contextlib.contextmanager
+def lead_inflight(key):
+    """Registers a run for `key`; the yielded future gets (final_response, returned_bids, log_entry)."""
+    flight = asyncio.get_running_loop().create_future()
+    flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+    if COALESCE_REQUESTS:
+        _inflight[key] = flight
+    try:
+        yield flight
+    except Exception as e:
+        if not flight.done():
+            flight.set_exception(e)
+        raise
+    finally:
+        if _inflight.get(key) is flight:
+            del _inflight[key]
+        # Abandoned (cancelled or closed stream): waiting requests run the pipeline themselves
+        if not flight.done():
+            flight.cancel()
+
+async def join_inflight(key, log_entry, start_time):
+    """The (final_response, returned_bids) of an identical run in progress, or None if there is none."""
+    while COALESCE_REQUESTS:
+        flight = _inflight.get(key)
+        if flight is None:
+            return None
+        try:
+            with span("coalesced_wait"):
+                final_response, returned_bids, leader_entry = await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if flight.cancelled():
+                continue
+            raise
+        log_entry.update({
+            "coalesced": True,
+            "support_level": leader_entry["support_level"],
+            "used_query": leader_entry["used_query"],
+            "book_ids": leader_entry["book_ids"],
+            "pre_translated_answer": leader_entry["pre_translated_answer"],
+            "final_answer": final_response,
+            "time_to_first_token": round(time.perf_counter() - start_time, 3)
+        })
+        log_interaction(log_entry)
+        return final_response, returned_bids
+    return None
+
+# --- Main function: pipeline to process query and return final answer ---
+async def answer_query_async(user_query, to_print=False):
+    start_time = time.perf_counter()
+    log_entry = new_log_entry(user_query)
+    cached, query_embedding = await get_cached_answer_async(user_query, log_entry["query_language"])
+    if cached is not None:
+        final_response, returned_bids = cached
+        log_entry.update({
+            "cache_hit": True,
+            "final_answer": final_response,
+            "time_to_first_token": round(time.perf_counter() - start_time, 3)
+        })
+        if to_print:
+            print(f"User's Question: {user_query}\nFinal Answer (cached): {final_response}")
+        log_interaction(log_entry)
+        return final_response, returned_bids
+
+    key = inflight_key(user_query, log_entry["query_language"])
+    coalesced = await join_inflight(key, log_entry, start_time)
+    if coalesced is not None:
+        if to_print:
+            print(f"User's Question: {user_query}\nFinal Answer (coalesced): {coalesced[0]}")
+        return coalesced
+
+    with lead_inflight(key) as flight:
+        response, returned_bids, context_display = await prepare_answer_async(user_query, log_entry)
+        final_response = await translate_response_async(user_query, response, log_entry["query_language"])
+        # Without streaming the user sees nothing until the whole answer is ready
+        log_entry["time_to_first_token"] = round(time.perf_counter() - start_time, 3)
+
+        # Success case
+        if to_print:
+            print(f"User's Question: {user_query}\nFinal Answer: {final_response}")
+            print("\nContext:\n", context_display)
+
+        returned_bids = await finish_answer_async(user_query, log_entry, query_embedding, final_response, returned_bids)
+        flight.set_result((final_response, returned_bids, log_entry))
+    return final_response, returned_bids
+
+# --- Streaming variant: yields the final answer's tokens, logs the assembled text ---
+async def answer_query_stream_async(user_query):
+    start_time = time.perf_counter()
+    log_entry = new_log_entry(user_query)
+    cached, query_embedding = await get_cached_answer_async(user_query, log_entry["query_language"])
+    if cached is not None:
+        final_response, _ = cached
+        log_entry.update({
+            "cache_hit": True,
+            "final_answer": final_response,
+            "time_to_first_token": round(time.perf_counter() - start_time, 3)
+        })
+        log_interaction(log_entry)
+        yield final_response
+        return
+
+    key = inflight_key(user_query, log_entry["query_language"])
+    coalesced = await join_inflight(key, log_entry, start_time)
+    if coalesced is not None:
+        yield coalesced[0]
+        return
+
+    with lead_inflight(key) as flight:
+        response, returned_bids, _ = await prepare_answer_async(user_query, log_entry)
+        parts = []
+        async for token in translate_response_stream_async(user_query, response, log_entry["query_language"]):
+            if not parts:
+                token = token.lstrip()
+                if not token:
+                    continue
+                log_entry["time_to_first_token"] = round(time.perf_counter() - start_time, 3)
+            parts.append(token)
+            yield token
+
+        final_response = "".join(parts).strip()
+        returned_bids = await finish_answer_async(user_query, log_entry, query_embedding, final_response, returned_bids)
+        flight.set_result((final_response, returned_bids, log_entry))
+
+def answer_query(user_query, to_print=False):
+    return run_sync(answer_query_async(user_query, to_print))
+
+def answer_query_stream(user_query):
+    """Sync generator over answer_query_stream_async, for callers outside the backend loop."""
+    tokens = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for token in answer_query_stream_async(user_query):
+                tokens.put(token)
+            tokens.put(done)
+        except Exception as e:
+            tokens.put(e)
+
+    asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    while True:
+        item = tokens.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
 
 
 def load_pkl(path):
@@ -370,14 +1077,135 @@ def load_pkl(path):
     return pd.read_pickle(pickle_file)
 
 
-def initialize_components():
-    global data, retriever, vectorstore, answer_prompt, answer_llm, rephraser_prompt, rephraser_llm, verifier_prompt, verifier_llm, judge_prompt, judge_llm, translation_prompt, translation_llm, style_prompt, style_llm
-    data = load_pkl('combined_chunks.pkl')
-    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large")
-    answer_prompt, answer_llm, rephraser_prompt, rephraser_llm, verifier_prompt, verifier_llm, judge_prompt, judge_llm, style_prompt, style_llm, translation_prompt, translation_llm = initialize_llm()
-    retriever = initialize_retriever("faiss_index_openai_3textlarge_copy", embedding_model)
-    print("Done initialize")
+def index_files_fingerprint():
+    return files_fingerprint([INDEX_NAME, BM25_INDEX_NAME, CHUNK_STORE_NAME, os.path.join(DATA_PATH, CHUNKS_FILE)])
+
+
+def initialize_answer_cache(fingerprint):
+    cache = answer_cache or AnswerCache(
+        ANSWER_CACHE_PATH,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds=ANSWER_CACHE_TTL,
+        threshold=ANSWER_CACHE_THRESHOLD
+    )
+    # Cached answers are only valid for the index and chunks they were produced from
+    cache.ensure_fingerprint(fingerprint)
+    return cache
+
+
+def initialize_components(force=False):
+    """Load the shared components once per process. Later calls are no-ops unless `force`."""
+    global data, retriever, vectorstore, embedding_model, answer_cache, support_gate, answer_prompt, answer_llm, rephraser_prompt, rephraser_llm, verifier_prompt, verifier_llm, judge_prompt, judge_llm, translation_prompt, translation_llm, style_prompt, style_llm, fused_style_prompt, styled_answer_prompt
+    global components_error, components_fingerprint
+    with _components_lock:
+        if components_ready.is_set() and not force:
+            return
+        try:
+            # Build everything before swapping it in, so a reload never exposes a half-loaded state
+            fingerprint = index_files_fingerprint()
+            # The chunk store and the BM25 index both check the pickle's hash; read it once
+            chunks_path = os.path.join(DATA_PATH, CHUNKS_FILE)
+            chunks_sha256 = file_sha256(chunks_path)
+            new_data = load_chunk_store(CHUNK_STORE_NAME, chunks_path, chunks_sha256)
+            new_embedding_model = CachedEmbeddings(
+                OpenAIEmbeddings(model="text-embedding-3-large"),
+                EMBEDDING_CACHE_PATH,
+                max_memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES
+            )
+            llm_components = initialize_llm()
+            new_retriever = initialize_retriever(INDEX_NAME, new_embedding_model, new_data, chunks_sha256)
+            new_answer_cache = initialize_answer_cache(fingerprint)
+            new_support_gate = SupportGate.load(SUPPORT_GATE_PATH, audit_rate=SUPPORT_GATE_AUDIT_RATE)
+        except Exception as e:
+            components_error = e
+            raise
 
+        with _swap_lock:
+            data, embedding_model, retriever, answer_cache = new_data, new_embedding_model, new_retriever, new_answer_cache
+            support_gate = new_support_gate
+            components_fingerprint = fingerprint
+        answer_prompt, answer_llm, rephraser_prompt, rephraser_llm, verifier_prompt, verifier_llm, judge_prompt, judge_llm, style_prompt, style_llm, translation_prompt, translation_llm, fused_style_prompt, styled_answer_prompt = llm_components
+        components_error = None
+        components_ready.set()
+        print("Done initialize")
+
+
+def warm_up():
+    """Start loading the components in a background thread (at most once) and return immediately."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if components_ready.is_set() or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+            return
+        _warm_up_thread = threading.Thread(target=_warm_up_worker, name="backend-warm-up", daemon=True)
+        _warm_up_thread.start()
+
+
+def _warm_up_worker():
+    try:
+        initialize_components()
+    except Exception as e:
+        print(f"Backend warm-up failed: {e}")
+
+
+def is_ready():
+    return components_ready.is_set()
+
+
+def wait_until_ready(timeout=None):
+    """Block until the components are loaded; warms them up first if nobody has yet."""
+    warm_up()
+    thread = _warm_up_thread
+    deadline = None if timeout is None else time.monotonic() + timeout
+    # Wait in slices so a failed warm-up ends the wait instead of running out the timeout
+    while not components_ready.is_set() and thread is not None and thread.is_alive():
+        remaining = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+        if remaining <= 0:
+            break
+        components_ready.wait(remaining)
+    if not components_ready.is_set() and components_error is not None:
+        raise components_error
+    return components_ready.is_set()
+
+
+def reload_components():
+    """Reload the chunks, index and clients, e.g. after the index files were rebuilt."""
+    initialize_components(force=True)
+
+
+def reload_if_changed():
+    """Reload only if the index or chunk files changed since they were loaded; returns True if it did."""
+    if components_ready.is_set() and index_files_fingerprint() == components_fingerprint:
+        return False
+    reload_components()
+    return True
+
+
+
+def metrics_snapshot():
+    """Per-stage latency percentiles, tokens and cost since startup, plus scheduler and log stats."""
+    snapshot = {
+        "stages": stage_metrics.snapshot(),
+        "llm_scheduler": dict(llm_scheduler.stats),
+        "log_sink": dict(get_log_sink().stats),
+    }
+    if support_gate is not None:
+        snapshot["support_gate"] = support_gate.stats()
+    if answer_cache is not None:
+        snapshot["answer_cache"] = answer_cache.stats()
+    if embedding_model is not None and hasattr(embedding_model, "stats"):
+        snapshot["embedding_cache"] = embedding_model.stats()
+    return snapshot
+
+
+def dump_metrics(path=None):
+    """Print the metrics snapshot, or write it to `path` as JSON."""
+    snapshot = metrics_snapshot()
+    if path is None:
+        print(json.dumps(snapshot, indent=2))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2)
+    return snapshot
 
 if __name__ == "__main__":
     initialize_components()
@@ -0,0 +1,115 @@
+"""
+Compare langchain's BM25Retriever (pure-Python rank_bm25) with the prebuilt CSR BM25 index.
+
+Run from the repository root:
+    python benchmarks/bm25_benchmark.py --scales 1 10 100
+
+The corpus is the chunk pickle (or a synthetic one with --synthetic N), scaled up by adding
+copies with a random 10% of each chunk's words dropped. Queries come from the query log
+when it exists, otherwise from random chunk snippets.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from langchain_community.retrievers import BM25Retriever
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bm25_index import BM25Index, PrebuiltBM25Retriever, build_bm25_index  # noqa: E402
+from log_sink import read_log_entries  # noqa: E402
+
+
+def load_base_chunks(chunks_path, synthetic, rng):
+    if synthetic or not os.path.exists(chunks_path):
+        vocab = [f"w{i}" for i in range(20000)]
+        weights = 1.0 / np.arange(1, len(vocab) + 1)  # Zipf-like term frequencies
+        weights /= weights.sum()
+        n = synthetic or 5000
+        return [
+            Document(page_content=" ".join(rng.choices(vocab, weights=weights, k=260)), metadata={"idx": i})
+            for i in range(n)
+        ]
+    return list(pd.read_pickle(chunks_path))
+
+
+def scale_corpus(base, factor, rng):
+    docs = list(base)
+    for _ in range(factor - 1):
+        for doc in base:
+            words = [w for w in doc.page_content.split() if rng.random() > 0.1]
+            docs.append(Document(page_content=" ".join(words), metadata={"idx": len(docs)}))
+    return docs
+
+
+def load_queries(log_path, docs, n, rng):
+    queries = [e["original_query"] for e in read_log_entries(log_path)]
+    while len(queries) < n:
+        words = rng.choice(docs).page_content.split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append(" ".join(words[start:start + rng.randint(2, 8)]))
+    return queries[:n]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return f"p50 {np.percentile(ms, 50):8.2f} ms  p95 {np.percentile(ms, 95):8.2f} ms"
+
+
+def run(docs, queries, k, check):
+    print(f"\n=== {len(docs)} chunks, {len(queries)} queries ===")
+    reference, build_ref = timed(BM25Retriever.from_documents, docs)
+    reference.k = k
+    print(f"BM25Retriever.from_documents: {build_ref:8.2f} s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _, build_csr = timed(build_bm25_index, docs, tmp, "benchmark")
+        index, load_csr = timed(BM25Index.load, tmp)
+        csr = PrebuiltBM25Retriever(index=index, docs=docs, k=k)
+        print(f"build_bm25_index (offline):   {build_csr:8.2f} s")
+        print(f"BM25Index.load (startup):     {load_csr * 1000:8.2f} ms")
+
+        ref_times, csr_times, mismatches = [], [], 0
+        for i, q in enumerate(queries):
+            ref_docs, t_ref = timed(reference.invoke, q)
+            csr_docs, t_csr = timed(csr.invoke, q)
+            ref_times.append(t_ref)
+            csr_times.append(t_csr)
+            if i < check and [d.metadata["idx"] for d in ref_docs] != [d.metadata["idx"] for d in csr_docs]:
+                mismatches += 1
+        _, t_batch = timed(csr.get_relevant_documents_batch, queries)
+
+        print(f"rank_bm25 per query:          {percentiles(ref_times)}")
+        print(f"CSR per query:                {percentiles(csr_times)}")
+        print(f"CSR batch of {len(queries)}:            {t_batch / len(queries) * 1000:8.2f} ms per query")
+        print(f"speedup (p50):                {np.median(ref_times) / np.median(csr_times):8.1f}x")
+        print(f"ranking mismatches:           {mismatches} / {min(check, len(queries))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", default="./data/combined_chunks.pkl")
+    parser.add_argument("--log", default="./logs/query_log.jsonl")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N synthetic chunks instead of the pickle")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--check", type=int, default=50, help="queries whose rankings are compared")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    base = load_base_chunks(args.chunks, args.synthetic, rng)
+    for factor in args.scales:
+        docs = scale_corpus(base, factor, rng)
+        run(docs, load_queries(args.log, docs, args.queries, rng), args.k, args.check)
@@ -0,0 +1,98 @@
+"""
+Calibrate CONSISTENCY_AGREEMENT (backend.py) from the query log.
+
+Every answer that drew the full n_consistency samples logs the agreement of its first
+CONSISTENCY_INITIAL_SAMPLES samples ("consistency_agreement") and the sample the judge chose
+("judge_choice"). Stopping early at a threshold is safe for a request when the judge kept one
+of the first samples anyway (or all samples were identical). Collect the log with
+ADAPTIVE_CONSISTENCY = False, so every request is judged over all samples.
+
+Run from the repository root:
+    python benchmarks/consistency_calibration.py --log ./logs/query_log.jsonl
+
+Prints, per threshold, the share of requests that would stop early, the answer/judge calls
+they save and how often the judge agreed with the early stop, and suggests the lowest
+threshold that meets --target.
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from log_sink import read_log_entries  # noqa: E402
+
+
+def judged_samples(entries, initial):
+    """(agreement, samples, early stop was safe) per request that drew more than `initial` samples."""
+    samples = []
+    for e in entries:
+        agreement, drawn = e.get("consistency_agreement"), e.get("consistency_samples")
+        if agreement is None or not drawn or drawn <= initial:
+            continue
+        if e.get("judge_called"):
+            if e.get("judge_choice") is None:
+                continue
+            safe = e["judge_choice"] < initial
+        else:
+            safe = True  # every sample was identical
+        samples.append((agreement, drawn, safe))
+    return samples
+
+
+def calibration_table(samples, initial, thresholds):
+    rows = []
+    for t in thresholds:
+        stopped = [(drawn, safe) for agreement, drawn, safe in samples if agreement >= t]
+        rows.append({
+            "threshold": t,
+            "stopped": len(stopped),
+            "stop_share": len(stopped) / len(samples),
+            "answer_calls_saved": sum(drawn - initial for drawn, _ in stopped) / len(samples),
+            "judge_calls_saved": len(stopped) / len(samples),
+            "safe_rate": float(np.mean([safe for _, safe in stopped])) if stopped else None,
+        })
+    return rows
+
+
+def suggest_threshold(rows, target, min_samples):
+    for row in rows:
+        if row["stopped"] >= min_samples and row["safe_rate"] is not None and row["safe_rate"] >= target:
+            return row["threshold"]
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default="./logs/query_log.jsonl")
+    parser.add_argument("--initial-samples", type=int, default=2, help="CONSISTENCY_INITIAL_SAMPLES")
+    parser.add_argument("--target", type=float, default=0.9, help="share of early stops the judge must agree with")
+    parser.add_argument("--min-samples", type=int, default=30, help="fewest early stops a threshold needs")
+    args = parser.parse_args()
+
+    samples = judged_samples(read_log_entries(args.log), args.initial_samples)
+    if not samples:
+        sys.exit(f"No judged answers with a logged agreement in {args.log}")
+
+    agreements = np.array([a for a, _, _ in samples])
+    print(f"{len(samples)} judged answers; first-round agreement "
+          f"p25 {np.percentile(agreements, 25):.3f}, p50 {np.percentile(agreements, 50):.3f}, "
+          f"p75 {np.percentile(agreements, 75):.3f}")
+    chance = np.mean([args.initial_samples / drawn for _, drawn, _ in samples])
+    print(f"The judge keeps a first sample by chance {chance:.0%} of the time\n")
+
+    rows = calibration_table(samples, args.initial_samples, np.round(np.arange(0.05, 1.0001, 0.05), 2))
+    print("| threshold | stop early | answer calls saved / req | judge calls saved / req | judge agreed |")
+    print("| --- | --- | --- | --- | --- |")
+    for row in rows:
+        safe = "-" if row["safe_rate"] is None else f"{row['safe_rate']:.3f}"
+        print(f"| {row['threshold']:.2f} | {row['stop_share']:.1%} | {row['answer_calls_saved']:.2f} | "
+              f"{row['judge_calls_saved']:.2f} | {safe} |")
+
+    threshold = suggest_threshold(rows, args.target, args.min_samples)
+    if threshold is None:
+        print(f"\nNo threshold reaches {args.target:.0%} agreement with at least {args.min_samples} early stops; "
+              "keep ADAPTIVE_CONSISTENCY = False")
+    else:
+        print(f"\nSuggested CONSISTENCY_AGREEMENT = {threshold:.2f}")
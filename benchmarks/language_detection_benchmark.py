@@ -0,0 +1,103 @@
+"""
+Compare per-query language detection with langdetect against the LanguageRouter
+(Hebrew-script fast path, then the fasttext lid.176 model).
+
+Run from the repository root:
+    python benchmarks/language_detection_benchmark.py --model ./data/lid.176.bin
+
+Queries come from the query log when it exists, otherwise from a small built-in sample.
+Without fasttext or the model file the router falls back to langdetect for non-Hebrew text.
+"""
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+import numpy as np
+from langdetect import detect, DetectorFactory
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from language_router import LanguageRouter, needs_translation  # noqa: E402
+from log_sink import read_log_entries  # noqa: E402
+
+DetectorFactory.seed = 0
+
+SAMPLE_QUERIES = [
+    # The sidebar examples of frontend.py, in both languages
+    "מה החזון שלך למדינת ישראל?",
+    "איך התמודדת עם קריאת המדינה?",
+    "מה דעתך על הנגב?",
+    "איך ראית את עתיד החינוך בישראל?",
+    "מה היו האתגרים הגדולים בתקופתך?",
+    "What is your vision for the State of Israel?",
+    "How did you handle the declaration of independence?",
+    "What is your opinion about the Negev?",
+    "How do you see the future of education in Israel?",
+    "What were the biggest challenges of your time?",
+    # Other languages the translation step serves, mixed-script and non-text input
+    "Какой была ваша роль в Войне за независимость?",
+    "ما هو موقفك من العلاقات مع الدول العربية؟",
+    "Que pensiez-vous de l'immigration juive en Palestine?",
+    "מה דעתך על Weizmann ועל הציונות המדינית?",
+    "1948",
+]
+
+def load_queries(log_path):
+    queries = [e["original_query"] for e in read_log_entries(log_path)]
+    return queries or SAMPLE_QUERIES
+
+
+def langdetect_lang(text):
+    try:
+        return detect(text)
+    except Exception:
+        return "unknown"
+
+
+def timed_each(fn, queries):
+    results, times = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(fn(q))
+        times.append(time.perf_counter() - start)
+    return results, times
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return f"p50 {np.percentile(ms, 50):8.3f} ms  p95 {np.percentile(ms, 95):8.3f} ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default="./logs/query_log.jsonl")
+    parser.add_argument("--model", default="./data/lid.176.bin")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the queries")
+    args = parser.parse_args()
+
+    queries = load_queries(args.log) * args.repeat
+    router = LanguageRouter(args.model)
+    start = time.perf_counter()
+    router.detect("warm up")  # model load is a one-off startup cost
+    print(f"router warm-up (model load):  {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    # The old pipeline detected twice per request (log entry and translation)
+    ld_langs, ld_times = timed_each(langdetect_lang, queries)
+    router_langs, router_times = timed_each(router._detect, queries)  # without the LRU
+    _, cached_times = timed_each(router.detect, queries)
+
+    print(f"\n=== {len(queries)} queries ===")
+    print(f"langdetect per query:         {percentiles(ld_times)}")
+    print(f"router per query:             {percentiles(router_times)}")
+    print(f"router (cached) per query:    {percentiles(cached_times)}")
+    print(f"speedup (p50):                {np.median(ld_times) / np.median(router_times):8.1f}x")
+    print(f"per request, old vs new:      {2 * np.mean(ld_times) * 1000:8.3f} ms vs {np.mean(router_times) * 1000:8.3f} ms")
+
+    agree = sum(a == b for a, b in zip(ld_langs, router_langs))
+    routing = sum(needs_translation(a) == needs_translation(b) for a, b in zip(ld_langs, router_langs))
+    print(f"same language:                {agree} / {len(queries)}")
+    print(f"same translation routing:     {routing} / {len(queries)}")
+    disagreements = Counter((a, b) for a, b in zip(ld_langs, router_langs) if a != b)
+    for (a, b), n in disagreements.most_common(10):
+        print(f"  langdetect {a:>8} -> router {b:<8} x{n}")
@@ -0,0 +1,409 @@
+"""
+Benchmark the answer pipeline offline: backend.answer_query end to end with local stand-ins for
+ChatOpenAI and OpenAIEmbeddings, so only the orchestration code is measured.
+
+Run from the repository root:
+    python benchmarks/pipeline_bench.py --chunks 20000 --queries 60 --users 1 4 16
+    python benchmarks/pipeline_bench.py --output bench.json
+    python benchmarks/pipeline_bench.py --baseline bench.json   # exits 1 on a regression
+
+The corpus is synthetic (FAISS, BM25 and chunk store are built in a temporary directory).
+Queries are replayed from the query log when it exists, otherwise drawn from the corpus.
+The stand-ins sleep for a configurable latency per call (e.g. "lognormal:1.0,0.35" = median
+1 s, or "fixed:0.2", "uniform:0.5,1.5", "0") and answer deterministically from the prompt:
+the verifier returns canned JSON with a configurable support mix, the rephraser returns query
+variants, the judge picks "Answer 1" and style/translation echo their input. The LLM rate
+limits are off unless --rate-limits is given.
+
+Reported per concurrency level: request latency, throughput, per-stage spans and peak RSS
+(the level's own peak on Linux, where the high-water mark can be reset; elsewhere the whole
+process's peak so far, corpus build included).
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import hashlib
+import argparse
+import resource
+import tempfile
+from typing import Any, List
+
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_community.vectorstores import FAISS
+from langchain.prompts import PromptTemplate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import backend  # noqa: E402
+import tracing  # noqa: E402
+from bm25_index import build_bm25_index, file_sha256  # noqa: E402
+from chunk_store import build_chunk_store, load_chunk_store  # noqa: E402
+from embedding_cache import CachedEmbeddings  # noqa: E402
+from llm_scheduler import LLMScheduler  # noqa: E402
+from log_sink import read_log_entries  # noqa: E402
+
+ROLES = ["answer", "rephraser", "verifier", "judge", "style", "translation"]
+SUPPORT_LEVELS = {"strong": "Strong support", "partial": "Partial support", "no": "No support"}
+# Inputs backend.py passes to each prompt
+PROMPT_VARIABLES = {
+    "answer_prompt": ["query", "context"],
+    "rephraser_prompt": ["question"],
+    "verifier_prompt": ["query", "context"],
+    "judge_prompt": ["query", "context", "answers"],
+    "style_prompt": ["input"],
+    "translation_prompt": ["user_language", "input"],
+    "fused_style_prompt": ["user_language", "input"],
+    "styled_answer_prompt": ["query", "context", "user_language"],
+}
+
+
+# --- Latency distributions ---
+def parse_latency(spec, rng):
+    """Sampler of seconds per call from "fixed:s", "uniform:a,b", "lognormal:median,sigma" or "0"."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind in ("0", "none"):
+        return lambda: 0.0
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(np.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution {spec!r}")
+
+
+def stable_seed(*parts):
+    return int.from_bytes(hashlib.sha256("\x1f".join(map(str, parts)).encode("utf-8")).digest()[:8], "little")
+
+
+# --- Stand-ins for the API clients ---
+class StubChatModel(BaseChatModel):
+    """Chat model that sleeps for `latency()` and answers with `respond(prompt_text)`."""
+
+    model_name: str
+    respond: Any
+    latency: Any
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _result(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        text = self.respond(prompt)
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": len(prompt) // 3,
+            "output_tokens": len(text) // 3,
+            "total_tokens": (len(prompt) + len(text)) // 3,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency())
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency())
+        return self._result(messages)
+
+
+class StubEmbeddings(Embeddings):
+    """Deterministic unit vectors from a hash of the text, after `latency()` per request."""
+
+    def __init__(self, dims, latency=None):
+        self.dims = dims
+        self.latency = latency or (lambda: 0.0)
+        self.model = "stub-embedding"
+
+    def _vector(self, text):
+        v = np.random.default_rng(stable_seed(text)).standard_normal(self.dims).astype(np.float32)
+        return (v / np.linalg.norm(v)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency())
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency())
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+def make_responders(support_mix, answer_agreement, variants, rng):
+    levels, weights = zip(*support_mix.items())
+
+    def verifier(prompt):
+        level = random.Random(stable_seed("verifier", prompt)).choices(levels, weights)[0]
+        quotes = []
+        match = re.search(r"\[Book ID: ([^\]]+)\]\n(.{0,200})", prompt)
+        if level == "Strong support" and match:
+            quotes = [{"text": match.group(2), "book_id": match.group(1)}]
+        return json.dumps({"support_level": level, "quotes": quotes}, ensure_ascii=False)
+
+    def rephraser(prompt):
+        words = prompt.split()[-8:]
+        lines = []
+        for i in range(variants):
+            shuffled = list(words)
+            random.Random(stable_seed("rephrase", prompt, i)).shuffle(shuffled)
+            lines.append(" ".join(shuffled))
+        return "\n".join(lines + ["### done"])
+
+    def answer(prompt):
+        words = prompt.split()
+        canonical = random.Random(stable_seed("answer", prompt))
+        text = [canonical.choice(words) for _ in range(80)]
+        if rng.random() >= answer_agreement:
+            # A disagreeing sample: the second half in words of its own
+            text = text[:40] + [f"w{rng.randrange(10 ** 6)}" for _ in range(40)]
+        return " ".join(text)
+
+    def echo(prompt):
+        return prompt.strip().splitlines()[-1] if prompt.strip() else ""
+
+    return {
+        "answer": answer,
+        "rephraser": rephraser,
+        "verifier": verifier,
+        "judge": lambda prompt: "Answer 1",
+        "style": echo,
+        "translation": echo,
+    }
+
+
+# --- Synthetic corpus ---
+def synthetic_chunks(n, rng, chunks_per_document=4, words_per_chunk=120):
+    letters = "אבגדהוזחטיכלמנסעפצקרשת"
+    vocab = ["".join(rng.choices(letters, k=rng.randint(2, 7))) for _ in range(20000)]
+    weights = 1.0 / np.arange(1, len(vocab) + 1)  # Zipf-like term frequencies
+    docs = []
+    for idx in range(n):
+        book = idx // chunks_per_document
+        docs.append(Document(
+            page_content=" ".join(rng.choices(vocab, weights=weights, k=words_per_chunk)),
+            metadata={"book_id": 100000 + book, "headline": f"מסמך {book}", "source": "DBGH", "idx": idx},
+        ))
+    return docs
+
+
+def build_workspace(work, docs, dims):
+    data_path = os.path.join(work, "data")
+    os.makedirs(data_path)
+    chunks_path = os.path.join(data_path, backend.CHUNKS_FILE)
+    pd.to_pickle(docs, chunks_path)
+    sha = file_sha256(chunks_path)
+
+    index_path = os.path.join(work, "faiss_index")
+    vectorstore = FAISS.from_documents(docs, StubEmbeddings(dims))
+    vectorstore.save_local(index_path)
+    build_bm25_index(docs, os.path.join(work, "bm25_index"), sha)
+    build_chunk_store(docs, os.path.join(work, "chunk_store"), sha, vectorstore, index_path)
+
+    backend.DATA_PATH = data_path + os.sep
+    backend.INDEX_NAME = index_path
+    backend.BM25_INDEX_NAME = os.path.join(work, "bm25_index")
+    backend.CHUNK_STORE_NAME = os.path.join(work, "chunk_store")
+    backend.LOG_PATH = os.path.join(work, "logs", "query_log.jsonl")
+    return chunks_path
+
+
+def with_variables(prompt, variables):
+    # The stand-ins answer from the rendered text, so every input has to appear in it
+    missing = "".join(f"\n{{{v}}}" for v in variables if f"{{{v}}}" not in prompt.template)
+    return PromptTemplate.from_template(prompt.template + missing)
+
+
+def install_components(work, chunks_path, args, rng):
+    embeddings = StubEmbeddings(args.dims, parse_latency(args.embedding_latency, rng))
+    if args.embedding_cache:
+        embeddings = CachedEmbeddings(embeddings, os.path.join(work, "embedding_cache.sqlite"))
+    backend.embedding_model = embeddings
+    backend.data = load_chunk_store(backend.CHUNK_STORE_NAME, chunks_path)
+    backend.retriever = backend.initialize_retriever(backend.INDEX_NAME, embeddings, backend.data)
+    backend.support_gate = None
+    backend.answer_cache = None
+    if args.answer_cache:
+        backend.ANSWER_CACHE_PATH = os.path.join(work, "answer_cache.sqlite")
+        backend.answer_cache = backend.initialize_answer_cache(backend.index_files_fingerprint())
+
+    (answer_prompt, _, rephraser_prompt, _, verifier_prompt, _, judge_prompt, _,
+     style_prompt, _, translation_prompt, _, fused_style_prompt, styled_answer_prompt) = backend.initialize_llm()
+    prompts = {
+        "answer_prompt": answer_prompt, "rephraser_prompt": rephraser_prompt, "verifier_prompt": verifier_prompt,
+        "judge_prompt": judge_prompt, "style_prompt": style_prompt, "translation_prompt": translation_prompt,
+        "fused_style_prompt": fused_style_prompt, "styled_answer_prompt": styled_answer_prompt,
+    }
+    for name, variables in PROMPT_VARIABLES.items():
+        setattr(backend, name, with_variables(prompts[name], variables))
+
+    support_mix = {SUPPORT_LEVELS[k]: float(v) for k, v in (p.split("=") for p in args.support_mix.split(","))}
+    responders = make_responders(support_mix, args.answer_agreement, args.variants, rng)
+    models = {"answer": "gpt-4.1", "rephraser": "gpt-4.1", "verifier": "gpt-4.1", "judge": "gpt-4.1",
+              "style": "gpt-4.1-mini", "translation": "gpt-4o-mini"}
+    latencies = dict(role.split("=", 1) for role in args.role_latency)
+    for role in ROLES:
+        llm = StubChatModel(
+            model_name=models[role],
+            respond=responders[role],
+            latency=parse_latency(latencies.get(role, args.llm_latency), rng),
+        )
+        setattr(backend, f"{role}_llm", llm)
+
+    limits = backend.LLM_RATE_LIMITS if args.rate_limits else {}
+    backend.llm_scheduler = LLMScheduler(max_workers=backend.LLM_MAX_CONCURRENCY, limits=limits)
+    backend.components_ready.set()
+
+
+def load_queries(log_path, docs, n, foreign_share, rng):
+    queries = [e["original_query"] for e in read_log_entries(log_path)]
+    while len(queries) < n:
+        words = rng.choice(docs).page_content.split()
+        start = rng.randrange(max(1, len(words) - 8))
+        query = " ".join(words[start:start + rng.randint(3, 8)])
+        if rng.random() < foreign_share:
+            query = f"What did Ben-Gurion say about {query} and why was it important?"
+        queries.append(query)
+    return queries[:n]
+
+
+# --- Load generation ---
+async def run_level(queries, users):
+    """Each simulated user sends its share of the queries one after another."""
+    latencies = []
+
+    async def user(share):
+        for q in share:
+            start = time.perf_counter()
+            await backend.answer_query_async(q)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(queries[i::users]) for i in range(users)))
+    return latencies, time.perf_counter() - start
+
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark (VmHWM, Linux); False where that is not possible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(since_reset):
+    """VmHWM (the peak since reset_peak_rss) if it was reset, else the peak over the whole process."""
+    if since_reset:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def run(queries, users_levels):
+    results = {}
+    for users in users_levels:
+        tracing.metrics.reset()
+        # ru_maxrss would include the corpus build and earlier levels
+        per_level = reset_peak_rss()
+        latencies, wall = backend.run_sync(run_level(queries, users))
+        results[str(users)] = {
+            "requests": len(latencies),
+            "latency": tracing.summarize(latencies),
+            "throughput_rps": round(len(latencies) / wall, 3),
+            "stages": tracing.metrics.snapshot(),
+            "peak_rss_mb": round(peak_rss_mb(per_level), 1),
+            "peak_rss_scope": "level" if per_level else "process",
+        }
+        r = results[str(users)]
+        print(f"\n=== {users} concurrent users, {len(latencies)} requests ===")
+        print(f"request latency:  p50 {r['latency']['p50']:.3f} s  p95 {r['latency']['p95']:.3f} s  p99 {r['latency']['p99']:.3f} s")
+        print(f"throughput:       {r['throughput_rps']:.2f} requests/s")
+        scope = "this level" if per_level else "whole process so far"
+        print(f"peak RSS:         {r['peak_rss_mb']:.0f} MB ({scope})")
+        print(tracing.format_summary(r["stages"]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against a saved run: slower p50/p95 latency or lower throughput beyond `tolerance`."""
+    regressions = []
+    for users, r in results.items():
+        base = baseline.get(users)
+        if base is None:
+            continue
+        for p in ("p50", "p95"):
+            if r["latency"][p] > base["latency"][p] * (1 + tolerance):
+                regressions.append(f"{users} users: {p} latency {base['latency'][p]:.3f} -> {r['latency'][p]:.3f} s")
+        if r["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{users} users: throughput {base['throughput_rps']:.2f} -> {r['throughput_rps']:.2f} rps")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000, help="synthetic corpus size")
+    parser.add_argument("--dims", type=int, default=256, help="embedding dimensions")
+    parser.add_argument("--log", default="./logs/query_log.jsonl", help="queries to replay")
+    parser.add_argument("--queries", type=int, default=60)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="concurrency levels")
+    parser.add_argument("--llm-latency", default="lognormal:1.0,0.35")
+    parser.add_argument("--role-latency", action="append", default=[], metavar="ROLE=SPEC",
+                        help=f"per-role override, roles: {', '.join(ROLES)}")
+    parser.add_argument("--embedding-latency", default="lognormal:0.15,0.3")
+    parser.add_argument("--support-mix", default="strong=0.3,partial=0.4,no=0.3")
+    parser.add_argument("--answer-agreement", type=float, default=0.7, help="chance a sample matches the canonical answer")
+    parser.add_argument("--variants", type=int, default=3, help="queries returned by the rephraser")
+    parser.add_argument("--foreign-share", type=float, default=0.2, help="share of synthetic queries not in Hebrew")
+    parser.add_argument("--no-embedding-cache", dest="embedding_cache", action="store_false")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache on (replays hit it)")
+    parser.add_argument("--rate-limits", action="store_true", help="apply the configured LLM_RATE_LIMITS (CHATDBG_LLM_RATE_LIMITS) to the stand-ins")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="save the results as JSON")
+    parser.add_argument("--baseline", default=None, help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix="pipeline_bench_")
+    try:
+        start = time.perf_counter()
+        docs = synthetic_chunks(args.chunks, rng)
+        chunks_path = build_workspace(work, docs, args.dims)
+        install_components(work, chunks_path, args, rng)
+        print(f"Built a {len(docs)} chunk workspace in {time.perf_counter() - start:.1f} s")
+
+        queries = load_queries(args.log, docs, args.queries, args.foreign_share, rng)
+        results = run(queries, args.users)
+        backend.get_log_sink().flush()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
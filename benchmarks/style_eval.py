@@ -0,0 +1,131 @@
+"""
+Compare the style/translation modes of backend.py (STYLE_MODE) on logged queries.
+
+Run from the repository root:
+    python benchmarks/style_eval.py --limit 30
+    python benchmarks/style_eval.py --end-to-end --modes two_step fused in_answer
+
+By default only the final stage is compared: "two_step" and "fused" rewrite the same logged
+pre-translation answers of non-Hebrew queries. "in_answer" changes the answer calls themselves,
+so it can only be measured with --end-to-end, which runs the whole pipeline once per mode
+(answer cache off). Outputs are compared with the "two_step" output of the same query by word
+overlap and embedding cosine similarity.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import backend  # noqa: E402
+from language_router import needs_translation  # noqa: E402
+from log_sink import read_log_entries  # noqa: E402
+
+MODES = ["two_step", "fused", "in_answer"]
+
+
+def load_entries(log_path, limit, end_to_end):
+    entries = read_log_entries(log_path)
+    if end_to_end:
+        entries = [e for e in entries if not e.get("cache_hit")]
+    else:
+        entries = [
+            e for e in entries
+            if e.get("pre_translated_answer") and needs_translation(e.get("query_language"))
+        ]
+    # One run per distinct question
+    unique = {e["original_query"]: e for e in entries}
+    return list(unique.values())[-limit:]
+
+
+async def run_stage(entry, mode):
+    backend.STYLE_MODE = mode
+    start = time.perf_counter()
+    output = await backend.translate_response_async(
+        entry["original_query"], entry["pre_translated_answer"], entry["query_language"]
+    )
+    return output, time.perf_counter() - start
+
+
+async def run_end_to_end(entry, mode):
+    backend.STYLE_MODE = mode
+    start = time.perf_counter()
+    output, _ = await backend.answer_query_async(entry["original_query"])
+    return output, time.perf_counter() - start
+
+
+def cosine(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+
+
+async def evaluate(entries, modes, end_to_end):
+    run = run_end_to_end if end_to_end else run_stage
+    outputs = {mode: [] for mode in modes}
+    times = {mode: [] for mode in modes}
+    for i, entry in enumerate(entries):
+        # Rotate the order so no mode always runs first (warmer rate limits, caches)
+        shift = i % len(modes)
+        for mode in modes[shift:] + modes[:shift]:
+            output, elapsed = await run(entry, mode)
+            outputs[mode].append(output)
+            times[mode].append(elapsed)
+        print(f"[{i + 1}/{len(entries)}] {entry['original_query'][:60]}")
+
+    vectors = {}
+    for mode in modes:
+        vectors[mode] = await backend.embedding_model.aembed_documents(outputs[mode])
+    return outputs, times, vectors
+
+
+def report(modes, outputs, times, vectors, baseline="two_step"):
+    lines = [
+        "| mode | p50 (s) | p95 (s) | mean (s) | word overlap vs two_step | cosine vs two_step |",
+        "| --- | --- | --- | --- | --- | --- |",
+    ]
+    for mode in modes:
+        t = np.array(times[mode])
+        if mode == baseline or baseline not in outputs:
+            overlap, cos = "-", "-"
+        else:
+            overlap = f"{np.mean([backend.answer_similarity(a, b) for a, b in zip(outputs[mode], outputs[baseline])]):.3f}"
+            cos = f"{np.mean([cosine(a, b) for a, b in zip(vectors[mode], vectors[baseline])]):.3f}"
+        lines.append(
+            f"| {mode} | {np.percentile(t, 50):.2f} | {np.percentile(t, 95):.2f} | {t.mean():.2f} | {overlap} | {cos} |"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default="./logs/query_log.jsonl")
+    parser.add_argument("--limit", type=int, default=30, help="most recent distinct queries to use")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=None)
+    parser.add_argument("--end-to-end", action="store_true", help="run the whole pipeline for each mode")
+    parser.add_argument("--output", default=None, help="write every output as JSON lines")
+    args = parser.parse_args()
+
+    modes = args.modes or (MODES if args.end_to_end else ["two_step", "fused"])
+    if "in_answer" in modes and not args.end_to_end:
+        parser.error("in_answer changes the answer calls; use --end-to-end")
+
+    backend.initialize_components()
+    backend.answer_cache = None
+    backend.LOG_PATH = os.devnull  # evaluation runs are not user traffic
+    entries = load_entries(args.log, args.limit, args.end_to_end)
+    if not entries:
+        sys.exit(f"No usable entries in {args.log}")
+
+    outputs, times, vectors = backend.run_sync(evaluate(entries, modes, args.end_to_end))
+    print()
+    print(report(modes, outputs, times, vectors))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for i, entry in enumerate(entries):
+                row = {"query": entry["original_query"], "language": entry.get("query_language")}
+                row.update({mode: outputs[mode][i] for mode in modes})
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
@@ -0,0 +1,268 @@
+import os
+import math
+import json
+import bisect
+import hashlib
+import argparse
+from collections import Counter
+from typing import Any, List
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Same scoring parameters as rank_bm25.BM25Okapi, which BM25Retriever uses
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+FORMAT_VERSION = 2
+
+
+def default_tokenize(text):
+    # Same as langchain's BM25Retriever default_preprocessing_func
+    return text.split()
+
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_bm25_index(documents, output_dir, source_sha256, tokenize=default_tokenize):
+    """
+    Tokenize `documents` once and save the BM25 statistics to `output_dir`.
+
+    Files (all .npy arrays can be memory-mapped):
+      terms.bin / term_offsets.npy   sorted vocabulary, UTF-8, term id = sorted position
+      postings_indptr.npy            CSR row pointers per term
+      postings_docs.npy              document positions per term
+      postings_weight.npy            BM25 weight idf * tf * (k1 + 1) / (tf + k1 * length norm)
+      doc_len.npy                    tokens per document
+      idf.npy                        BM25Okapi idf per term
+      meta.json                      parameters and the chunk file hash
+
+    The postings form a CSR term-document matrix, so a query's scores are a sparse dot product.
+    """
+    doc_freqs = [Counter(tokenize(doc.page_content)) for doc in documents]
+    doc_len = np.array([sum(freqs.values()) for freqs in doc_freqs], dtype=np.int32)
+
+    terms = sorted({term for freqs in doc_freqs for term in freqs})
+    term_ids = {term: i for i, term in enumerate(terms)}
+
+    postings = [[] for _ in terms]
+    for doc_pos, freqs in enumerate(doc_freqs):
+        for term, tf in freqs.items():
+            postings[term_ids[term]].append((doc_pos, tf))
+
+    nnz = sum(len(p) for p in postings)
+    # One index dtype for both arrays so scipy can wrap the memory maps without copying
+    index_dtype = np.int32 if max(nnz, len(documents)) < 2 ** 31 else np.int64
+    indptr = np.zeros(len(terms) + 1, dtype=index_dtype)
+    indptr[1:] = np.cumsum([len(p) for p in postings])
+    postings_docs = np.fromiter((d for p in postings for d, _ in p), dtype=index_dtype, count=nnz)
+    postings_tf = np.fromiter((tf for p in postings for _, tf in p), dtype=np.float64, count=nnz)
+
+    # idf exactly as BM25Okapi._calc_idf (same summation order for the average), including
+    # the epsilon floor for very common terms
+    num_docs = len(documents)
+    first_seen = dict.fromkeys(term for freqs in doc_freqs for term in freqs)
+    idf = np.zeros(len(terms))
+    idf_sum = 0.0
+    for term in first_seen:
+        i = term_ids[term]
+        freq = indptr[i + 1] - indptr[i]
+        idf[i] = math.log(num_docs - freq + 0.5) - math.log(freq + 0.5)
+        idf_sum += idf[i]
+    average_idf = idf_sum / len(terms) if terms else 0.0
+    idf[idf < 0] = BM25_EPSILON * average_idf
+
+    avgdl = float(doc_len.sum()) / num_docs if num_docs else 0.0
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[postings_docs] / avgdl)
+    postings_weight = np.repeat(idf, np.diff(indptr)) * (postings_tf * (BM25_K1 + 1) / (postings_tf + norm))
+
+    encoded = [term.encode("utf-8") for term in terms]
+    term_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(t) for t in encoded])
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "terms.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(output_dir, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(output_dir, "postings_indptr.npy"), indptr)
+    np.save(os.path.join(output_dir, "postings_docs.npy"), postings_docs)
+    np.save(os.path.join(output_dir, "postings_weight.npy"), postings_weight)
+    np.save(os.path.join(output_dir, "doc_len.npy"), doc_len)
+    np.save(os.path.join(output_dir, "idf.npy"), idf)
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "format_version": FORMAT_VERSION,
+            "num_docs": num_docs,
+            "num_terms": len(terms),
+            "avgdl": avgdl,
+            "k1": BM25_K1,
+            "b": BM25_B,
+            "epsilon": BM25_EPSILON,
+            "source_sha256": source_sha256,
+        }, f, indent=2)
+
+
+class BM25Index:
+    """A prebuilt BM25 index, scored as a CSR term-document matrix without re-tokenizing the corpus."""
+
+    def __init__(self, path, mmap=True):
+        mode = "r" if mmap else None
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"BM25 index at {path} has an unsupported format, rebuild it")
+        self.num_docs = self.meta["num_docs"]
+        self._terms = np.memmap(os.path.join(path, "terms.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(path, "terms.bin")) else np.zeros(0, dtype=np.uint8)
+        self._term_offsets = np.load(os.path.join(path, "term_offsets.npy"), mmap_mode=mode)
+        self.doc_len = np.load(os.path.join(path, "doc_len.npy"), mmap_mode=mode)
+        self.idf = np.load(os.path.join(path, "idf.npy"), mmap_mode=mode)
+        self.matrix = sparse.csr_matrix(
+            (
+                np.load(os.path.join(path, "postings_weight.npy"), mmap_mode=mode),
+                np.load(os.path.join(path, "postings_docs.npy"), mmap_mode=mode),
+                np.load(os.path.join(path, "postings_indptr.npy"), mmap_mode=mode),
+            ),
+            shape=(len(self._term_offsets) - 1, self.num_docs),
+            copy=False,
+        )
+        self._vocab = _SortedVocabulary(self._terms, self._term_offsets)
+
+    @classmethod
+    def load(cls, path, source_sha256=None, mmap=True):
+        """Load the index, refusing it if it was built from a different chunk file."""
+        index = cls(path, mmap=mmap)
+        if source_sha256 is not None and index.meta.get("source_sha256") != source_sha256:
+            raise ValueError(f"BM25 index at {path} was built from a different chunk file")
+        return index
+
+    def term_id(self, term):
+        return self._vocab.lookup(term)
+
+    def query_matrix(self, token_lists):
+        """Sparse (queries x terms) matrix with one entry per known query token, in query order."""
+        indptr, indices = [0], []
+        for tokens in token_lists:
+            for token in tokens:
+                term = self.term_id(token)
+                if term is not None:
+                    indices.append(term)
+            indptr.append(len(indices))
+        # Entries are deliberately left unsorted and unsummed: the sparse product then adds
+        # each token's weights in query order, exactly like rank_bm25, so scores (and the
+        # order of tied documents) are bit-for-bit the same
+        return sparse.csr_matrix(
+            (np.ones(len(indices)), np.array(indices, dtype=self.matrix.indices.dtype), np.array(indptr, dtype=self.matrix.indptr.dtype)),
+            shape=(len(token_lists), self.matrix.shape[0]),
+            copy=False,
+        )
+
+    def get_scores_batch(self, token_lists):
+        """Dense (queries x documents) BM25Okapi scores from one sparse matrix product."""
+        return (self.query_matrix(token_lists) @ self.matrix).toarray()
+
+    def get_scores(self, tokens):
+        return self.get_scores_batch([tokens])[0]
+
+    def top_n_batch(self, token_lists, n):
+        return [top_k(scores, n) for scores in self.get_scores_batch(token_lists)]
+
+    def top_n(self, tokens, n):
+        return top_k(self.get_scores(tokens), n)
+
+
+def top_k(scores, k):
+    """
+    The first k of np.argsort(scores)[::-1], as rank_bm25's get_top_n returns them.
+
+    argpartition selects the candidates in linear time. When tied scores make the order
+    depend on argsort's tie handling (e.g. a query that matches fewer than k documents),
+    the full sort is used so the ranking stays identical.
+    """
+    if k >= len(scores):
+        return np.argsort(scores)[::-1][:k]
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    top_scores = scores[candidates]
+    if np.count_nonzero(scores >= top_scores.min()) > k or len(np.unique(top_scores)) < k:
+        return np.argsort(scores)[::-1][:k]
+    return candidates[np.argsort(-top_scores)]
+
+
+class _SortedVocabulary:
+    """Binary search over the memory-mapped, sorted UTF-8 term list."""
+
+    def __init__(self, terms, offsets):
+        self._terms = terms
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._terms[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+    def lookup(self, term):
+        i = bisect.bisect_left(self, term)
+        return i if i < len(self) and self[i] == term else None
+
+
+class PrebuiltBM25Retriever(BaseRetriever):
+    """Drop-in replacement for BM25Retriever backed by a BM25Index built offline."""
+
+    index: Any
+    docs: Any
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [self.docs[int(i)] for i in self.index.top_n(default_tokenize(query), self.k)]
+
+    def get_relevant_documents_batch(self, queries: List[str]) -> List[List[Document]]:
+        """Top k documents for each query, scored together in one sparse matrix product."""
+        return [[doc for doc, _ in scored] for scored in self.get_scored_documents_batch(queries)]
+
+    def get_scored_documents_batch(self, queries: List[str]) -> List[List[tuple]]:
+        """Top k (document, BM25 score) pairs for each query."""
+        scores = self.index.get_scores_batch([default_tokenize(q) for q in queries])
+        return [[(self.docs[int(i)], float(row[i])) for i in top_k(row, self.k)] for row in scores]
+
+
+def load_bm25_retriever(index_path, documents, chunks_path, k=10, source_sha256=None):
+    """
+    Prebuilt BM25 retriever over `documents`, or None if the index is missing or stale.
+    Pass the pickle's `source_sha256` if it is already known, to avoid hashing it again.
+    """
+    if not os.path.exists(os.path.join(index_path, "meta.json")):
+        print(f"No prebuilt BM25 index at {index_path}, building it in memory")
+        return None
+    try:
+        index = BM25Index.load(index_path, source_sha256=source_sha256 or file_sha256(chunks_path))
+    except ValueError as e:
+        print(f"{e}, building it in memory")
+        return None
+    if index.num_docs != len(documents):
+        print(f"BM25 index at {index_path} does not match the loaded chunks, building it in memory")
+        return None
+    return PrebuiltBM25Retriever(index=index, docs=documents, k=k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the BM25 index for the chunk pickle.")
+    parser.add_argument("--chunks", default="./data/combined_chunks.pkl")
+    parser.add_argument("--output", default="./bm25_index")
+    args = parser.parse_args()
+
+    chunks = pd.read_pickle(args.chunks)
+    build_bm25_index(chunks, args.output, file_sha256(args.chunks))
+    print(f"Saved BM25 index for {len(chunks)} chunks to {args.output}")
@@ -0,0 +1,312 @@
+import os
+import re
+import json
+import atexit
+import shutil
+import argparse
+import tempfile
+from collections.abc import Mapping, Sequence
+
+import faiss
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+from bm25_index import file_sha256
+
+FORMAT_VERSION = 2
+# Chunks are cut with a 35-word overlap; look a bit further in case other sources used more
+MAX_OVERLAP_WORDS = 100
+
+
+def _plain(value):
+    # numpy scalars (e.g. book_id from a DataFrame) are not JSON serializable
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def word_overlap(previous, text, max_words=MAX_OVERLAP_WORDS):
+    """UTF-8 byte offset in `text` after the words it repeats from the end of `previous`."""
+    previous_words = previous.split()
+    matches = list(re.finditer(r"\S+", text))
+    words = [m.group() for m in matches]
+    for k in range(min(len(previous_words), len(words), max_words), 0, -1):
+        if previous_words[-k:] == words[:k]:
+            end = matches[k].start() if k < len(matches) else len(text)
+            return len(text[:end].encode("utf-8"))
+    return 0
+
+
+def document_layout(documents):
+    """
+    Per-row document bounds and overlap offsets.
+
+    Consecutive rows with the same metadata (apart from idx) are chunks of one document, in
+    order. doc_start / doc_end are its first and one-past-last rows; overlap_bytes is where
+    the text that is not repeated from the previous chunk begins.
+    """
+    n = len(documents)
+    doc_start = np.zeros(n, dtype=np.int64)
+    doc_end = np.zeros(n, dtype=np.int64)
+    overlap_bytes = np.zeros(n, dtype=np.int32)
+    start = 0
+    for row in range(1, n + 1):
+        if row < n and _document_key(documents[row]) == _document_key(documents[row - 1]):
+            overlap_bytes[row] = word_overlap(documents[row - 1].page_content, documents[row].page_content)
+            continue
+        doc_start[start:row] = start
+        doc_end[start:row] = row
+        start = row
+    return doc_start, doc_end, overlap_bytes
+
+
+def _document_key(doc):
+    return [(key, _plain(value)) for key, value in doc.metadata.items() if key != "idx"]
+
+
+def build_chunk_store(documents, output_dir, source_sha256, vectorstore=None, index_path=None):
+    """
+    Save `documents` as a columnar store in `output_dir`, one row per chunk in pickle order.
+
+    Files (all .npy arrays can be memory-mapped):
+      texts.bin / text_offsets.npy   chunk texts, UTF-8, row i = texts[offsets[i]:offsets[i + 1]]
+      idx.npy                        chunk idx per row
+      doc_start.npy / doc_end.npy    rows of the chunk's document, for O(1) neighbor lookups
+      overlap_bytes.npy              offset of the text not repeated from the previous chunk
+      col_<key>.npy / col_<key>.json other metadata (book_id, source, headline, ...), dictionary
+                                     encoded: codes per row (-1 = key absent) and the distinct values
+      faiss_rows.npy                 store row of each FAISS index row, if built with the index
+      meta.json                      metadata key order, chunk file and FAISS index hashes
+    """
+    keys = list(dict.fromkeys(key for doc in documents for key in doc.metadata))
+    columns = [key for key in keys if key != "idx"]
+
+    encoded = [doc.page_content.encode("utf-8") for doc in documents]
+    text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    text_offsets[1:] = np.cumsum([len(t) for t in encoded])
+    idx = np.array([doc.metadata["idx"] for doc in documents], dtype=np.int64)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "texts.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(output_dir, "text_offsets.npy"), text_offsets)
+    np.save(os.path.join(output_dir, "idx.npy"), idx)
+    for name, array in zip(("doc_start", "doc_end", "overlap_bytes"), document_layout(documents)):
+        np.save(os.path.join(output_dir, f"{name}.npy"), array)
+
+    for key in columns:
+        values, codes = {}, np.full(len(documents), -1, dtype=np.int32)
+        for row, doc in enumerate(documents):
+            if key in doc.metadata:
+                value = _plain(doc.metadata[key])
+                codes[row] = values.setdefault(json.dumps(value), len(values))
+        np.save(os.path.join(output_dir, f"col_{key}.npy"), codes)
+        with open(os.path.join(output_dir, f"col_{key}.json"), "w", encoding="utf-8") as f:
+            json.dump([json.loads(v) for v in values], f, ensure_ascii=False)
+
+    index_sha256 = None
+    if vectorstore is not None:
+        row_of_idx = {int(i): row for row, i in enumerate(idx)}
+        faiss_rows = np.array([
+            row_of_idx[vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).metadata["idx"]]
+            for i in range(vectorstore.index.ntotal)
+        ], dtype=np.int64)
+        np.save(os.path.join(output_dir, "faiss_rows.npy"), faiss_rows)
+        index_sha256 = file_sha256(os.path.join(index_path, "index.pkl"))
+
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "format_version": FORMAT_VERSION,
+            "num_chunks": len(documents),
+            "metadata_keys": keys,
+            "source_sha256": source_sha256,
+            "index_sha256": index_sha256,
+        }, f, indent=2)
+
+
+class ChunkStore(Sequence):
+    """
+    Read-only chunk store; texts and metadata codes are memory-mapped, so forked workers
+    share the pages. Indexing by row returns a Document, built on access.
+    """
+
+    def __init__(self, path, mmap=True):
+        mode = "r" if mmap else None
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Chunk store at {path} has an unsupported format, rebuild it")
+        self._texts = np.memmap(os.path.join(path, "texts.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(path, "texts.bin")) else np.zeros(0, dtype=np.uint8)
+        self._text_offsets = np.load(os.path.join(path, "text_offsets.npy"), mmap_mode=mode)
+        self.idx = np.load(os.path.join(path, "idx.npy"), mmap_mode=mode)
+        self.doc_start = np.load(os.path.join(path, "doc_start.npy"), mmap_mode=mode)
+        self.doc_end = np.load(os.path.join(path, "doc_end.npy"), mmap_mode=mode)
+        self._overlap_bytes = np.load(os.path.join(path, "overlap_bytes.npy"), mmap_mode=mode)
+        self.keys = self.meta["metadata_keys"]
+        self._codes, self._values = {}, {}
+        for key in self.keys:
+            if key == "idx":
+                continue
+            self._codes[key] = np.load(os.path.join(path, f"col_{key}.npy"), mmap_mode=mode)
+            with open(os.path.join(path, f"col_{key}.json"), encoding="utf-8") as f:
+                self._values[key] = json.load(f)
+
+        # Chunk idx are normally consecutive in pickle order; otherwise look rows up by search
+        n = len(self.idx)
+        self._first_idx = int(self.idx[0]) if n else 0
+        self._consecutive = n == 0 or bool(np.all(np.diff(self.idx) == 1))
+        self._idx_order = None if self._consecutive else np.argsort(self.idx, kind="stable")
+
+    @classmethod
+    def load(cls, path, source_sha256=None, mmap=True):
+        """Load the store, refusing it if it was built from a different chunk file."""
+        store = cls(path, mmap=mmap)
+        if source_sha256 is not None and store.meta.get("source_sha256") != source_sha256:
+            raise ValueError(f"Chunk store at {path} was built from a different chunk file")
+        return store
+
+    def __len__(self):
+        return len(self.idx)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        return Document(page_content=self.text(row), metadata=self.metadata(row))
+
+    def text(self, row, skip_overlap=False):
+        start = self._text_offsets[row] + (self._overlap_bytes[row] if skip_overlap else 0)
+        return self._texts[start:self._text_offsets[row + 1]].tobytes().decode("utf-8")
+
+    def window(self, row, k):
+        """Rows [lo, hi) of the chunk and up to k neighbors on each side within its document."""
+        return max(int(self.doc_start[row]), row - k), min(int(self.doc_end[row]), row + k + 1)
+
+    def span_text(self, lo, hi):
+        """Text of consecutive chunks lo..hi-1 of one document, each overlap included once."""
+        parts = [self.text(lo)] + [self.text(row, skip_overlap=True) for row in range(lo + 1, hi)]
+        return " ".join(part for part in parts if part)
+
+    def value(self, key, row, default=None):
+        if key == "idx":
+            return int(self.idx[row])
+        code = self._codes[key][row] if key in self._codes else -1
+        return default if code < 0 else self._values[key][code]
+
+    def metadata(self, row):
+        metadata = {}
+        for key in self.keys:
+            if key == "idx":
+                metadata[key] = int(self.idx[row])
+            elif self._codes[key][row] >= 0:
+                metadata[key] = self._values[key][self._codes[key][row]]
+        return metadata
+
+    def row_of(self, idx):
+        """Row of the chunk with metadata idx `idx`, or None."""
+        if self._consecutive:
+            row = idx - self._first_idx
+            return row if 0 <= row < len(self) else None
+        pos = np.searchsorted(self.idx, idx, sorter=self._idx_order)
+        if pos < len(self) and self.idx[self._idx_order[pos]] == idx:
+            return int(self._idx_order[pos])
+        return None
+
+    def get(self, idx):
+        row = self.row_of(idx)
+        return None if row is None else self[row]
+
+    def faiss_rows(self, index_path):
+        """Store row per FAISS row for the index at `index_path`, or None if not built for it."""
+        if not self.meta.get("index_sha256") or not os.path.exists(os.path.join(self.path, "faiss_rows.npy")):
+            return None
+        if file_sha256(os.path.join(index_path, "index.pkl")) != self.meta["index_sha256"]:
+            print(f"Chunk store at {self.path} was built for a different FAISS index")
+            return None
+        return np.load(os.path.join(self.path, "faiss_rows.npy"), mmap_mode="r")
+
+
+class ChunkDocstore(Docstore):
+    """FAISS docstore resolving documents through the chunk store; ids are store rows."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def search(self, search):
+        row = int(search)
+        if not 0 <= row < len(self.store):
+            return f"ID {search} not found."
+        return self.store[row]
+
+
+class FaissRowIds(Mapping):
+    """index_to_docstore_id backed by the memory-mapped faiss_rows array."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self.rows):
+            raise KeyError(i)
+        return int(self.rows[i])
+
+    def __iter__(self):
+        return iter(range(len(self.rows)))
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def load_chunk_store(path, chunks_path, source_sha256=None):
+    """The chunk store at `path`, or a temporary one built from the chunk pickle if it is missing or stale."""
+    source_sha256 = source_sha256 or file_sha256(chunks_path)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        try:
+            return ChunkStore.load(path, source_sha256=source_sha256)
+        except ValueError as e:
+            print(f"{e}, building a temporary one")
+    else:
+        print(f"No chunk store at {path}, building a temporary one")
+    tmp_dir = tempfile.mkdtemp(prefix="chunk_store_")
+    atexit.register(shutil.rmtree, tmp_dir, ignore_errors=True)
+    build_chunk_store(pd.read_pickle(chunks_path), tmp_dir, source_sha256)
+    return ChunkStore.load(tmp_dir)
+
+
+def load_faiss_vectorstore(index_path, embedding_model, store):
+    """
+    FAISS vectorstore whose documents come from `store` instead of the pickled docstore.
+    Falls back to FAISS.load_local when the store was not built for this index.
+    """
+    rows = store.faiss_rows(index_path) if isinstance(store, ChunkStore) else None
+    if rows is not None:
+        index = faiss.read_index(os.path.join(index_path, "index.faiss"))
+        if index.ntotal == len(rows):
+            return FAISS(
+                embedding_function=embedding_model,
+                index=index,
+                docstore=ChunkDocstore(store),
+                index_to_docstore_id=FaissRowIds(rows),
+            )
+        print(f"Chunk store at {store.path} does not match the FAISS index size")
+    return FAISS.load_local(
+        folder_path=index_path,
+        embeddings=embedding_model,
+        allow_dangerous_deserialization=True
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped chunk store for the chunk pickle.")
+    parser.add_argument("--chunks", default="./data/combined_chunks.pkl")
+    parser.add_argument("--index", default=os.environ.get("CHATDBG_INDEX", "faiss_index_openai_3textlarge_copy"),
+                        help="FAISS index folder whose rows are mapped to the store (default: CHATDBG_INDEX)")
+    parser.add_argument("--output", default="./chunk_store")
+    args = parser.parse_args()
+
+    chunks = pd.read_pickle(args.chunks)
+    vectorstore = FAISS.load_local(args.index, None, allow_dangerous_deserialization=True)
+    build_chunk_store(chunks, args.output, file_sha256(args.chunks), vectorstore, args.index)
+    print(f"Saved chunk store for {len(chunks)} chunks to {args.output}")
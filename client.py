@@ -0,0 +1,100 @@
+"""
+Client of the HTTP service in server.py, with the same entry points the frontend used from
+backend.py (is_ready, wait_until_ready, answer_query, answer_query_stream), plus service_status.
+"""
+import os
+import time
+
+import requests
+
+BACKEND_URL = os.environ.get("CHATDBG_BACKEND_URL", "http://localhost:8000")
+CONNECT_TIMEOUT = 5  # seconds
+READ_TIMEOUT = 180  # seconds between bytes of an answer
+
+
+class ServerBusy(Exception):
+    """The service turned the request away (429/503); retry after `retry_after` seconds."""
+
+    def __init__(self, detail, retry_after):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+
+class ServiceUnavailable(Exception):
+    """The service could not be reached, or its components failed to load."""
+
+
+def _check(response):
+    if response.status_code in (429, 503):
+        try:
+            detail = response.json().get("detail")
+        except ValueError:
+            detail = response.text
+        raise ServerBusy(detail, int(response.headers.get("Retry-After", 5)))
+    response.raise_for_status()
+
+
+def service_status():
+    """"ready", "loading" (up, components still loading) or "unavailable" (unreachable or failed to load)."""
+    try:
+        response = requests.get(f"{BACKEND_URL}/ready", timeout=CONNECT_TIMEOUT)
+    except requests.RequestException:
+        return "unavailable"
+    if response.status_code == 200:
+        return "ready"
+    try:
+        detail = response.json().get("detail")
+    except ValueError:
+        detail = None
+    return "loading" if detail == "loading" else "unavailable"
+
+
+def is_ready():
+    return service_status() == "ready"
+
+
+def wait_until_ready(timeout=None, poll_interval=1.0):
+    """Wait while the service loads; raises ServiceUnavailable at once if it is unavailable."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        status = service_status()
+        if status == "ready":
+            return True
+        if status == "unavailable":
+            raise ServiceUnavailable(f"The service at {BACKEND_URL} is unavailable")
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_interval)
+
+
+def answer_query(user_query):
+    try:
+        response = requests.post(
+            f"{BACKEND_URL}/answer",
+            json={"query": user_query},
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
+    except requests.ConnectionError as e:
+        raise ServiceUnavailable(f"The service at {BACKEND_URL} is unavailable") from e
+    _check(response)
+    result = response.json()
+    return result["answer"], result["book_ids"]
+
+
+def answer_query_stream(user_query):
+    """Yields the answer's text as the service streams it."""
+    try:
+        response = requests.post(
+            f"{BACKEND_URL}/answer/stream",
+            json={"query": user_query},
+            stream=True,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
+    except requests.ConnectionError as e:
+        raise ServiceUnavailable(f"The service at {BACKEND_URL} is unavailable") from e
+    with response:
+        _check(response)
+        response.encoding = "utf-8"
+        for text in response.iter_content(chunk_size=None, decode_unicode=True):
+            if text:
+                yield text
@@ -0,0 +1,169 @@
+import os
+import re
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text):
+    # Only differences the embedding model would not care about: Unicode form and whitespace
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with an in-memory LRU in front of an on-disk SQLite store.
+
+    Vectors are keyed by model name plus a SHA-256 of the normalized text and stored as
+    float32 blobs. Only cache misses reach the wrapped model, batched in a single request.
+    Memory hits never touch SQLite. The async methods read and write the store in a worker thread.
+    """
+
+    def __init__(self, underlying, path, model_name=None, max_memory_entries=10000):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        self.max_memory_entries = max_memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()  # guards the memory LRU and counters
+        self._db_lock = threading.Lock()  # guards the connection; never taken while holding _lock
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self._conn.commit()
+
+    def _key(self, text):
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup_memory(self, keys):
+        vectors = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    vectors[i] = self._memory[key]
+                    self.memory_hits += 1
+        return vectors
+
+    def _lookup_disk(self, keys, vectors):
+        """Fill the memory misses in `vectors` from SQLite."""
+        missing = [key for key, vec in zip(keys, vectors) if vec is None]
+        found = {}
+        with self._db_lock:
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall())
+        with self._lock:
+            for i, key in enumerate(keys):
+                if vectors[i] is None and key in found:
+                    vectors[i] = np.frombuffer(found[key], dtype=np.float32)
+                    self._remember(key, vectors[i])
+                    self.disk_hits += 1
+        return vectors
+
+    def _lookup(self, texts):
+        """Cached vectors (None for misses) and the keys of every text."""
+        keys = [self._key(t) for t in texts]
+        vectors = self._lookup_memory(keys)
+        if any(vec is None for vec in vectors):
+            self._lookup_disk(keys, vectors)
+        return vectors, keys
+
+    async def _alookup(self, texts):
+        keys = [self._key(t) for t in texts]
+        vectors = self._lookup_memory(keys)
+        if any(vec is None for vec in vectors):
+            await asyncio.to_thread(self._lookup_disk, keys, vectors)
+        return vectors, keys
+
+    def _add_computed(self, vectors, keys, computed):
+        """Remember the computed vectors; returns the merged result and the rows to write to disk."""
+        missing = list(dict.fromkeys(k for k, v in zip(keys, vectors) if v is None))
+        by_key = dict(zip(missing, (np.asarray(v, dtype=np.float32) for v in computed)))
+        with self._lock:
+            for key, vec in by_key.items():
+                self._remember(key, vec)
+            self.misses += len(by_key)
+        rows = [(key, vec.tobytes()) for key, vec in by_key.items()]
+        return [(v if v is not None else by_key[k]).tolist() for v, k in zip(vectors, keys)], rows
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self._db_lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def _missing_texts(self, texts, vectors, keys):
+        # Each distinct missing text is sent once, even if it repeats within the batch
+        first = {}
+        for text, vec, key in zip(texts, vectors, keys):
+            if vec is None and key not in first:
+                first[key] = text
+        return list(first.values())
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, keys = self._lookup(texts)
+        missing_texts = self._missing_texts(texts, vectors, keys)
+        computed = self.underlying.embed_documents(missing_texts) if missing_texts else []
+        result, rows = self._add_computed(vectors, keys, computed)
+        self._write(rows)
+        return result
+
+    def embed_query(self, text: str) -> List[float]:
+        vectors, keys = self._lookup([text])
+        computed = [self.underlying.embed_query(text)] if vectors[0] is None else []
+        result, rows = self._add_computed(vectors, keys, computed)
+        self._write(rows)
+        return result[0]
+
+    # The async variants run on the backend loop, so disk reads and commits go to a worker thread
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, keys = await self._alookup(texts)
+        missing_texts = self._missing_texts(texts, vectors, keys)
+        computed = await self.underlying.aembed_documents(missing_texts) if missing_texts else []
+        result, rows = self._add_computed(vectors, keys, computed)
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+        return result
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors, keys = await self._alookup([text])
+        computed = [await self.underlying.aembed_query(text)] if vectors[0] is None else []
+        result, rows = self._add_computed(vectors, keys, computed)
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+        return result[0]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
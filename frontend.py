@@ -1,5 +1,6 @@
 import streamlit as st
-from backend import *
+# The pipeline runs in the HTTP service (server.py); this app is only its client
+from client import service_status, wait_until_ready, answer_query_stream, ServerBusy, ServiceUnavailable
 import time
 import random
 import base64
@@ -35,6 +36,9 @@ TEXTS = {
     "he": {
         "welcome": "שלום רב! אני דוד בן-גוריון. אשמח לשוחח איתכם על חזון המדינה, על ההיסטוריה שלנו, ועל האתגרים שעומדים בפנינו. במה תרצו לדון?",
         "input_placeholder": "הקלידו את השאלה כאן...",
+        "loading": "⏳ טוען את הארכיון...",
+        "busy": "⏳ יש כרגע עומס רב. נסו שוב בעוד {seconds} שניות.",
+        "unavailable": "⚠️ השירות אינו זמין כרגע. נסו שוב מאוחר יותר.",
         "send": "📤 שלח הודעה",
         "clear": "🗑️ נקה צ'אט",
         "title": "שוחחו עם מייסד המדינה על חזון, היסטוריה ועתיד",
@@ -63,6 +67,9 @@ chatDBG הוא צ'אטבוט מבוסס בינה מלאכותית המדמה א
     "en": {
         "welcome": "Shalom! I am David Ben-Gurion. Ask me anything about the vision of Israel, its history or future.",
         "input_placeholder": "Type your question here...",
+        "loading": "⏳ Loading the archive...",
+        "busy": "⏳ Many people are asking right now. Please try again in {seconds} seconds.",
+        "unavailable": "⚠️ The service is unavailable right now. Please try again later.",
         "send": "📤 Send Message",
         "clear": "🗑️ Clear Chat",
         "title": "Talk to Israel's Founding Father about vision, history, and the future",
@@ -387,8 +394,6 @@ CLOSING_MESSAGES_EN = [
 # 7. FUNCTIONS
 # ----------------------------
 
-initialize_components()
-
 def maybe_end_chat():
     now = time.time()
     timeout = now - st.session_state.last_interaction > 60 * 5
@@ -408,6 +413,17 @@ def clear_chat():
     st.session_state.user_message_count = 0
     st.session_state.chat_ended = False
 
+# Shared by all sessions, so reruns don't each ask the service whether it is up
+@st.cache_data(ttl=10, show_spinner=False)
+def cached_service_status():
+    return service_status()
+
+def report_unavailable():
+    # The question wasn't answered, so it doesn't count towards the session limit
+    cached_service_status.clear()
+    st.session_state.user_message_count -= 1
+    st.session_state.messages.append({"role": "error", "content": TEXTS[lang]["unavailable"]})
+
 def process_user_input(user_input):
     if not user_input or st.session_state.chat_ended:
         return
@@ -417,12 +433,38 @@ def process_user_input(user_input):
     st.session_state.last_interaction = time.time()
     st.session_state.user_message_count += 1
     
-    # Get bot response
+    # Get bot response, rendering the final stage's tokens as they arrive
+    status = cached_service_status()
+    if status == "unavailable":
+        report_unavailable()
+        return
+    if status == "loading":
+        with st.spinner(TEXTS[lang]["loading"]):
+            try:
+                # If the service is still loading after this, the request below reports it
+                wait_until_ready(timeout=120)
+            except ServiceUnavailable:
+                report_unavailable()
+                return
+    st.markdown(f'<div class="user-message">{user_input}</div>', unsafe_allow_html=True)
+    bubble = st.empty()
+    bubble.markdown('<div class="thinking-animation"><div class="thinking-dots"><div class="thinking-dot"></div><div class="thinking-dot"></div><div class="thinking-dot"></div></div></div>', unsafe_allow_html=True)
     try:
-        response, _ = answer_query(user_input, to_print=False)
+        response = ""
+        for token in answer_query_stream(user_input):
+            response += token
+            bubble.markdown(f'<div class="bot-message">{response}▌</div>', unsafe_allow_html=True)
+        response = response.strip()
         st.session_state.messages.append({"role": "bot", "content": response})
         # Check if chat should end after processing
         maybe_end_chat()
+    except ServiceUnavailable:
+        bubble.empty()
+        report_unavailable()
+    except ServerBusy as e:
+        # The question wasn't answered, so it doesn't count towards the session limit
+        st.session_state.user_message_count -= 1
+        st.session_state.messages.append({"role": "bot", "content": TEXTS[lang]["busy"].format(seconds=e.retry_after)})
     except Exception as e:
         st.error(f"שגיאה: {str(e)}")
 
@@ -447,6 +489,10 @@ with st.sidebar:
     st.markdown("---")
     st.markdown(TEXTS[lang]['disclaimer'], unsafe_allow_html=True)
 
+    status = cached_service_status()
+    if status != "ready":
+        st.markdown(f'<div class="status-indicator">{TEXTS[lang][status]}</div>', unsafe_allow_html=True)
+
 # ----------------------------
 # 9. MAIN CONTENT
 # ----------------------------
@@ -474,6 +520,9 @@ with col2:
     if st.session_state.messages:
         st.markdown('<div class="chat-container">', unsafe_allow_html=True)
         for msg in st.session_state.messages:
+            if msg["role"] == "error":
+                st.error(msg["content"])
+                continue
             role = "user-message" if msg["role"] == "user" else "bot-message"
             st.markdown(f'<div class="{role}">{msg["content"]}</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
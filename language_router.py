@@ -0,0 +1,72 @@
+import os
+import re
+import functools
+import threading
+
+from langdetect import detect, DetectorFactory
+
+try:
+    import fasttext
+except ImportError:
+    fasttext = None
+
+DetectorFactory.seed = 0
+
+HEBREW_LETTER = re.compile(r"[א-ת]")
+# Letters of any script (\w minus digits and underscore)
+LETTER = re.compile(r"[^\W\d_]")
+HEBREW_SHARE = 0.5
+
+
+def script_language(text):
+    """'he' if most letters are Hebrew, 'unknown' if there are no letters, else None (undecided)."""
+    letters = len(LETTER.findall(text))
+    if not letters:
+        return "unknown"
+    if len(HEBREW_LETTER.findall(text)) / letters >= HEBREW_SHARE:
+        return "he"
+    return None
+
+
+def needs_translation(lang):
+    # Answers are written in Hebrew; only a known other language is worth a translation call
+    return lang not in ("he", "unknown")
+
+
+class LanguageRouter:
+    """
+    Detects a query's language once: a Hebrew-script fast path, then fasttext's lid.176 model
+    (loaded on first use and shared), then langdetect if fasttext or the model is unavailable.
+    """
+
+    def __init__(self, model_path, cache_size=4096):
+        self.model_path = model_path
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.detect = functools.lru_cache(maxsize=cache_size)(self._detect)
+
+    def _load_model(self):
+        with self._model_lock:
+            if self._model is None:
+                if fasttext is None or not os.path.exists(self.model_path):
+                    print(f"fasttext or {self.model_path} not available, detecting languages with langdetect")
+                    self._model = False
+                else:
+                    self._model = fasttext.load_model(self.model_path)
+        return self._model
+
+    def _detect(self, text):
+        if not isinstance(text, str) or text.strip() == "":
+            return "unknown"
+        lang = script_language(text)
+        if lang is not None:
+            return lang
+        model = self._model if self._model is not None else self._load_model()
+        if model:
+            # fasttext predicts one line at a time
+            label = model.predict(text.replace("\n", " "))[0][0]
+            return label.replace("__label__", "")
+        try:
+            return detect(text)
+        except Exception:
+            return "unknown"
@@ -0,0 +1,220 @@
+import time
+import random
+import asyncio
+import itertools
+import threading
+from contextlib import asynccontextmanager
+
+from openai import RateLimitError, APIConnectionError, InternalServerError
+
+# Lower numbers are served first
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 10
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class Priority:
+    """A priority that can be raised while its calls wait, e.g. once speculative work is needed."""
+
+    def __init__(self, level):
+        self.level = level
+
+
+def _level(priority):
+    return priority.level if isinstance(priority, Priority) else priority
+
+
+class TokenBucket:
+    """Allows `per_minute` units per minute, refilled continuously, with a one-minute burst."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        # Settle the difference between estimated and actual usage; may go into debt
+        self.level = min(self.capacity, self.level - amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "model", "tokens", "loop", "wakeup")
+
+    def __init__(self, priority, seq, model, tokens, loop):
+        self.priority = priority
+        self.seq = seq
+        self.model = model
+        self.tokens = tokens
+        self.loop = loop
+        self.wakeup = None
+
+    @property
+    def key(self):
+        return _level(self.priority), self.seq
+
+
+class LLMScheduler:
+    """
+    Process-wide gate for LLM calls.
+
+    Bounds the number of in-flight calls, enforces per-model request/token per-minute
+    budgets, serves waiting calls by priority (then arrival order) and retries transient
+    API errors with jittered exponential backoff. State is guarded by a thread lock and
+    waiters are woken on their own event loop, so callers may come from any loop.
+    """
+
+    def __init__(self, max_workers=16, limits=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.max_workers = max_workers
+        self.limits = limits or {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._active = 0
+        self._seq = itertools.count()
+        self._buckets = {}
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "queued_seconds": 0.0}
+
+    def _model_buckets(self, model):
+        if model not in self._buckets:
+            limit = self.limits.get(model, {})
+            self._buckets[model] = (
+                TokenBucket(limit["rpm"]) if limit.get("rpm") else None,
+                TokenBucket(limit["tpm"]) if limit.get("tpm") else None,
+            )
+        return self._buckets[model]
+
+    def _try_grant(self, waiter):
+        """Under the lock: 0 if `waiter` got a slot, else seconds to wait (None = until woken)."""
+        if self._active >= self.max_workers:
+            return None
+        for other in self._waiting:
+            # Strictly higher priority goes first; same priority queues per model in arrival order
+            if other is not waiter and (other.key[0] < waiter.key[0] or (
+                    other.key[0] == waiter.key[0] and other.model == waiter.model and other.key < waiter.key)):
+                return None
+        requests, tokens = self._model_buckets(waiter.model)
+        now = time.monotonic()
+        wait = max(
+            requests.wait_time(1, now) if requests else 0.0,
+            tokens.wait_time(waiter.tokens, now) if tokens else 0.0,
+        )
+        if wait > 0:
+            return wait
+        if requests:
+            requests.take(1)
+        if tokens:
+            tokens.take(waiter.tokens)
+        self._waiting.remove(waiter)
+        self._active += 1
+        # The next waiter in line may now be able to start its own rate-limit wait
+        self._notify()
+        return 0.0
+
+    def _notify(self):
+        for waiter in self._waiting:
+            if waiter.wakeup is not None and not waiter.wakeup.done():
+                waiter.loop.call_soon_threadsafe(_wake, waiter.wakeup)
+
+    async def acquire(self, model, priority=PRIORITY_USER, tokens=0):
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        waiter = _Waiter(priority, next(self._seq), model, tokens, loop)
+        with self._lock:
+            self._waiting.append(waiter)
+        granted = False
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_grant(waiter)
+                    if wait == 0:
+                        granted = True
+                        self.stats["queued_seconds"] += time.monotonic() - started
+                        return
+                    waiter.wakeup = loop.create_future()
+                await asyncio.wait({waiter.wakeup}, timeout=wait)
+        finally:
+            if not granted:
+                with self._lock:
+                    if waiter in self._waiting:
+                        self._waiting.remove(waiter)
+                    self._notify()
+
+    def release(self, model=None, estimated=0, actual=None):
+        with self._lock:
+            self._active -= 1
+            if model is not None and actual is not None:
+                tokens = self._model_buckets(model)[1]
+                if tokens:
+                    tokens.adjust(actual - estimated)
+            self._notify()
+
+    def raise_priority(self, priority, level):
+        """Raise a Priority shared by waiting calls to `level` and let them compete again."""
+        with self._lock:
+            priority.level = min(priority.level, level)
+            self._notify()
+
+    def backoff(self, attempt, error=None):
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    async def run(self, call, model, priority=PRIORITY_USER, tokens=0):
+        """Await `call()` (a coroutine factory) within the limits, retrying transient API errors."""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(model, priority, tokens)
+            actual = None
+            try:
+                self.stats["calls"] += 1
+                result = await call()
+                usage = getattr(result, "usage_metadata", None)
+                if usage:
+                    actual = usage.get("total_tokens")
+                return result
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                delay = self.backoff(attempt, e)
+            finally:
+                self.release(model, tokens, actual)
+            print(f"LLM call to {model} failed, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, model, priority=PRIORITY_USER, tokens=0):
+        """Hold one slot for a call that cannot be retried transparently (e.g. a token stream)."""
+        await self.acquire(model, priority, tokens)
+        try:
+            self.stats["calls"] += 1
+            yield
+        finally:
+            self.release()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,155 @@
+import os
+import glob
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import datetime
+import threading
+
+_FLUSH = object()
+_STOP = object()
+
+
+class LogSink:
+    """
+    Appends JSON log entries from a background thread.
+
+    write() only enqueues the entry; the writer thread serializes entries and appends them in
+    batches, whenever `batch_size` entries are waiting or `flush_interval` seconds have passed.
+    The file is rotated when it would grow past `max_bytes` or when the day changes, and
+    rotated files are gzip-compressed next to it (the newest `backup_count` are kept, all if 0).
+    Pending entries are written at interpreter exit.
+    """
+
+    def __init__(self, path, batch_size=64, flush_interval=1.0, max_bytes=50 * 1024 * 1024,
+                 rotate_daily=True, backup_count=30, max_queue=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.backup_count = backup_count
+        self.stats = {"written": 0, "dropped": 0, "batches": 0, "rotations": 0, "errors": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, entry):
+        """
+        Queue an entry without blocking; it is dropped (and counted) if the queue is full.
+        The entry is serialized later, so it must not be modified afterwards.
+        """
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been written."""
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # --- Writer thread ---
+    def _run(self):
+        batch, waiters = [], []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stop = item is _STOP
+            if isinstance(item, tuple) and item[0] is _FLUSH:
+                waiters.append(item[1])
+            elif item is not None and not stop:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            due = deadline is not None and time.monotonic() >= deadline
+            if batch and (stop or waiters or due or len(batch) >= self.batch_size):
+                self._write_batch(batch)
+                batch, deadline = [], None
+            for done in waiters:
+                done.set()
+            waiters = []
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        try:
+            lines = []
+            for entry in batch:
+                lines.append(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            payload = "".join(lines).encode("utf-8")
+            self._maybe_rotate(len(payload))
+            with open(self.path, "ab") as f:
+                f.write(payload)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Could not write {len(batch)} log entries to {self.path}: {e}")
+
+    def _maybe_rotate(self, incoming):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Only regular files are rotated (not e.g. os.devnull)
+        if not os.path.isfile(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return
+        started = datetime.date.fromtimestamp(os.path.getmtime(self.path))
+        if size + incoming > self.max_bytes or (self.rotate_daily and started != datetime.date.today()):
+            self._rotate()
+
+    def _rotate(self):
+        stem, ext = os.path.splitext(self.path)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = f"{stem}.{stamp}{ext}"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        self.stats["rotations"] += 1
+        if self.backup_count:
+            for old in rotated_files(self.path)[:-self.backup_count]:
+                os.remove(old)
+
+
+def rotated_files(path):
+    """Compressed rotations of `path`, oldest first."""
+    stem, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(stem)}.*{ext}.gz"))
+
+
+def read_log_entries(path, include_rotated=True):
+    """Entries of the log at `path`, oldest first, including its compressed rotations."""
+    files = rotated_files(path) if include_rotated else []
+    if os.path.exists(path):
+        files.append(path)
+    entries = []
+    for name in files:
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(name, "rt", encoding="utf-8") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    return entries
@@ -0,0 +1,285 @@
+"""
+HTTP service in front of the backend. The components are loaded once per process and every
+request runs on the backend's event loop, behind a bounded admission queue.
+
+Run from the repository root (one worker process; it already serves requests concurrently):
+    python server.py --port 8000
+    uvicorn server:app --port 8000
+
+The admission limits come from CHATDBG_SERVER_CONCURRENCY, CHATDBG_SERVER_QUEUE_SIZE and
+CHATDBG_SERVER_QUEUE_TIMEOUT (either launch), or from --concurrency, --queue-size and
+--queue-timeout (python server.py only).
+
+Endpoints:
+    POST /answer         {"query": "..."} -> {"answer": "...", "book_ids": "..."}
+    POST /answer/stream  {"query": "..."} -> the answer as a chunked text/plain stream
+    GET  /health         liveness
+    GET  /ready          200 once the components are loaded, 503 before
+    GET  /metrics        stage histograms, scheduler, cache and admission stats
+
+When all slots are busy, requests wait in a FIFO queue. If the queue is full they get a 429.
+If they waited longer than the queue timeout they get a 503. Both carry a Retry-After header.
+"""
+import os
+import math
+import asyncio
+import argparse
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+import backend
+
+SERVER_CONCURRENCY = int(os.environ.get("CHATDBG_SERVER_CONCURRENCY", 8))  # pipelines running at once
+SERVER_QUEUE_SIZE = int(os.environ.get("CHATDBG_SERVER_QUEUE_SIZE", 32))  # requests allowed to wait for a slot
+SERVER_QUEUE_TIMEOUT = float(os.environ.get("CHATDBG_SERVER_QUEUE_TIMEOUT", 30.0))  # seconds a request may wait before it is turned away
+SERVER_LOADING_RETRY_AFTER = 10  # seconds, while the components are still loading
+DISCONNECT_POLL_INTERVAL = 0.5  # seconds between client disconnect checks on /answer
+MAX_QUERY_CHARS = 2000
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code, detail, retry_after):
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class AdmissionControl:
+    """
+    At most `concurrency` requests run at once and at most `queue_size` wait, in arrival
+    order. Retry-After is estimated from the queue length and recent request durations.
+    """
+
+    def __init__(self, concurrency, queue_size, queue_timeout):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self._waiting = deque()
+        self._durations = deque(maxlen=100)
+        self.stats = {"admitted": 0, "rejected_full": 0, "rejected_timeout": 0, "queued": 0}
+
+    def retry_after(self):
+        mean = sum(self._durations) / len(self._durations) if self._durations else 5.0
+        return max(1, math.ceil(mean * (len(self._waiting) + 1) / self.concurrency))
+
+    async def acquire(self):
+        if self.running < self.concurrency and not self._waiting:
+            self.running += 1
+            self.stats["admitted"] += 1
+            return
+        if len(self._waiting) >= self.queue_size:
+            self.stats["rejected_full"] += 1
+            raise Overloaded(429, "Too many requests are waiting", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            self.stats["rejected_timeout"] += 1
+            raise Overloaded(503, "Timed out waiting for a free slot", self.retry_after())
+        except asyncio.CancelledError:
+            self._remove(waiter)
+            raise
+        self.stats["admitted"] += 1
+
+    def _remove(self, waiter):
+        if waiter in self._waiting:
+            self._waiting.remove(waiter)
+        elif waiter.done() and not waiter.cancelled():
+            # The slot was handed over just as the wait ended; pass it on
+            self.release()
+
+    def release(self, duration=None):
+        if duration is not None:
+            self._durations.append(duration)
+        # Hand the slot straight to the next waiter, so it can't be taken out of turn
+        while self._waiting:
+            waiter = self._waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def snapshot(self):
+        return {"running": self.running, "waiting": len(self._waiting), **self.stats}
+
+
+admission = AdmissionControl(SERVER_CONCURRENCY, SERVER_QUEUE_SIZE, SERVER_QUEUE_TIMEOUT)
+
+
+class Question(BaseModel):
+    query: str
+
+
+# --- Bridges to the backend loop, which owns the LLM clients' connections ---
+async def run_on_backend(coro, request=None):
+    """
+    Run `coro` on the backend loop. Starlette does not cancel a plain handler when its client
+    disconnects, so with a `request` the client is polled and the pipeline cancelled if it left.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, backend.get_event_loop())
+    result = asyncio.wrap_future(future)
+    try:
+        while request is not None:
+            done, _ = await asyncio.wait({result}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                break
+            if await request.is_disconnected():
+                future.cancel()
+                raise ClientDisconnected()
+        return await result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+
+
+async def stream_from_backend(user_query):
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for token in backend.answer_query_stream_async(user_query):
+                loop.call_soon_threadsafe(tokens.put_nowait, token)
+            loop.call_soon_threadsafe(tokens.put_nowait, done)
+        except Exception as e:
+            loop.call_soon_threadsafe(tokens.put_nowait, e)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), backend.get_event_loop())
+    try:
+        while True:
+            item = await tokens.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+
+def check_query(question):
+    query = question.query.strip()
+    if not query:
+        raise HTTPException(422, "The query is empty")
+    if len(query) > MAX_QUERY_CHARS:
+        raise HTTPException(422, f"The query is longer than {MAX_QUERY_CHARS} characters")
+    return query
+
+
+async def admit():
+    if not backend.is_ready():
+        if backend.components_error is not None:
+            raise Overloaded(503, f"The backend failed to load: {backend.components_error}", SERVER_LOADING_RETRY_AFTER)
+        raise Overloaded(503, "The backend is still loading", SERVER_LOADING_RETRY_AFTER)
+    await admission.acquire()
+    return asyncio.get_running_loop().time()
+
+
+def finish(started):
+    admission.release(asyncio.get_running_loop().time() - started)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load in the background so /health answers right away and /ready reports progress
+    backend.warm_up()
+    yield
+    backend.get_log_sink().flush(timeout=10)
+
+
+app = FastAPI(title="chatDBG", lifespan=lifespan)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request, exc):
+    return Response(status_code=499)  # nobody reads it; the status is for the access log
+
+
+@app.post("/answer")
+async def answer(question: Question, request: Request):
+    query = check_query(question)
+    started = await admit()
+    try:
+        final_response, book_ids = await run_on_backend(backend.answer_query_async(query), request)
+    finally:
+        finish(started)
+    return {"answer": final_response, "book_ids": book_ids}
+
+
+@app.post("/answer/stream")
+async def answer_stream(question: Question, request: Request):
+    query = check_query(question)
+    started = await admit()
+
+    async def body():
+        try:
+            async for token in stream_from_backend(query):
+                if await request.is_disconnected():
+                    return
+                yield token
+        finally:
+            finish(started)
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "ready": backend.is_ready()}
+
+
+@app.get("/ready")
+async def ready():
+    if backend.is_ready():
+        return {"ready": True}
+    detail = str(backend.components_error) if backend.components_error is not None else "loading"
+    return JSONResponse(
+        status_code=503,
+        content={"ready": False, "detail": detail},
+        headers={"Retry-After": str(SERVER_LOADING_RETRY_AFTER)}
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    snapshot = await asyncio.to_thread(backend.metrics_snapshot)
+    snapshot["admission"] = admission.snapshot()
+    return snapshot
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=SERVER_CONCURRENCY)
+    parser.add_argument("--queue-size", type=int, default=SERVER_QUEUE_SIZE)
+    parser.add_argument("--queue-timeout", type=float, default=SERVER_QUEUE_TIMEOUT)
+    args = parser.parse_args()
+
+    admission = AdmissionControl(args.concurrency, args.queue_size, args.queue_timeout)
+    uvicorn.run(app, host=args.host, port=args.port)
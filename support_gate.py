@@ -0,0 +1,224 @@
+"""
+Score-based gate in front of the LLM support verifier.
+
+A logistic model over the retrieval scores (top FAISS similarity, top BM25 score per query
+token) estimates the chance that the verifier would find support. Far enough from the
+ambiguous band the gate answers itself and the verifier call is skipped.
+
+Fit the thresholds offline from the query log:
+    python support_gate.py --log ./logs/query_log.jsonl --output ./data/support_gate.json
+"""
+import os
+import json
+import math
+import random
+import argparse
+import datetime
+import threading
+
+import numpy as np
+
+FEATURES = ["faiss_sim", "bm25_norm"]
+SUPPORT_LEVELS = ["Strong support", "Partial support", "No support"]
+
+
+def retrieval_features(faiss_sim, bm25_top, query_tokens):
+    return {
+        "faiss_sim": float(faiss_sim),
+        "bm25_norm": float(bm25_top) / max(1, query_tokens),
+    }
+
+
+class SupportGate:
+    """Applies a fitted gate; decide() returns "Strong support", "No support" or None (ask the LLM)."""
+
+    def __init__(self, params, audit_rate=0.0):
+        self.params = params
+        self.audit_rate = audit_rate
+        self._lock = threading.Lock()
+        self.decisions = 0
+        self.skipped = 0
+        self.audited = 0
+        self.agreed = 0
+
+    @classmethod
+    def load(cls, path, audit_rate=0.0):
+        """The gate saved at `path`, or None if there is none (every request goes to the verifier)."""
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), audit_rate)
+
+    def probability(self, features):
+        p = self.params
+        x = [(features[name] - mean) / std for name, mean, std in zip(FEATURES, p["mean"], p["std"])]
+        z = p["intercept"] + sum(c * v for c, v in zip(p["coef"], x))
+        return 1 / (1 + math.exp(-z))
+
+    def decide(self, features):
+        prob = self.probability(features)
+        if self.params.get("no_below") is not None and prob < self.params["no_below"]:
+            return "No support"
+        if self.params.get("strong_above") is not None and prob > self.params["strong_above"]:
+            return "Strong support"
+        return None
+
+    def should_audit(self):
+        return random.random() < self.audit_rate
+
+    def record(self, decision, verifier_level=None):
+        """Count a gate decision; `verifier_level` is the LLM's verdict when the decision was audited."""
+        with self._lock:
+            self.decisions += 1
+            if verifier_level is None:
+                self.skipped += 1
+            else:
+                self.audited += 1
+                self.agreed += agrees(decision, verifier_level)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "decisions": self.decisions,
+                "skipped": self.skipped,
+                "audited": self.audited,
+                "agreement": self.agreed / self.audited if self.audited else None,
+            }
+
+
+def agrees(decision, verifier_level):
+    # "Strong" only promises that there is support; a Partial verdict answers the same way
+    if decision == "No support":
+        return verifier_level == "No support"
+    return verifier_level in ("Strong support", "Partial support")
+
+
+# --- Offline fitting ---
+def labeled_queries(entries):
+    """
+    (query, support_level) pairs implied by logged requests.
+
+    The original query was verified first; if it had no support, the rephrased variants were
+    verified in order until one had support (used_query) or all were tried.
+    """
+    samples = []
+    for entry in entries:
+        for record in entry.get("verifications") or []:
+            # Newer entries log every verifier call with its scores directly
+            if record.get("verifier") in SUPPORT_LEVELS:
+                samples.append((record, record["verifier"]))
+        if entry.get("verifications") is not None or entry.get("cache_hit"):
+            continue
+        level = entry.get("support_level")
+        if level not in SUPPORT_LEVELS:
+            continue
+        variants = entry.get("rephrased_queries") or []
+        used = entry.get("used_query")
+        if not variants:
+            samples.append((entry["original_query"], level))
+            continue
+        samples.append((entry["original_query"], "No support"))
+        for query in variants:
+            if query == used and used != entry["original_query"]:
+                samples.append((query, level))
+                break
+            samples.append((query, "No support"))
+    return samples
+
+
+def fit_logistic(x, y, l2=1e-2, iterations=50):
+    """Logistic regression by Newton's method on standardized features."""
+    mean, std = x.mean(axis=0), x.std(axis=0) + 1e-9
+    z = np.hstack([np.ones((len(x), 1)), (x - mean) / std])
+    w = np.zeros(z.shape[1])
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-z @ w))
+        gradient = z.T @ (p - y) + l2 * np.r_[0, w[1:]]
+        hessian = (z.T * (p * (1 - p))) @ z + l2 * np.diag(np.r_[0, np.ones(len(w) - 1)])
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return mean, std, w
+
+
+def pick_thresholds(prob, y, target_precision, min_samples):
+    """Widest no_below / strong_above bands whose decisions reach `target_precision`."""
+    no_below, strong_above = None, None
+    for t in np.unique(prob):
+        below = prob < t
+        if below.sum() >= min_samples and (y[below] == 0).mean() >= target_precision:
+            no_below = float(t)
+    for t in np.unique(prob)[::-1]:
+        above = prob > t
+        if above.sum() >= min_samples and (y[above] == 1).mean() >= target_precision:
+            strong_above = float(t)
+    if no_below is not None and strong_above is not None and no_below > strong_above:
+        no_below = strong_above
+    return no_below, strong_above
+
+
+def evaluate(params, features, labels):
+    gate = SupportGate(params)
+    decisions = [gate.decide(f) for f in features]
+    decided = [(d, l) for d, l in zip(decisions, labels) if d is not None]
+    return {
+        "samples": len(labels),
+        "skip_rate": len(decided) / len(labels) if labels else 0.0,
+        "agreement": sum(agrees(d, l) for d, l in decided) / len(decided) if decided else None,
+    }
+
+
+def fit_support_gate(features, labels, target_precision=0.95, min_samples=20):
+    x = np.array([[f[name] for name in FEATURES] for f in features])
+    y = np.array([label != "No support" for label in labels], dtype=float)
+    mean, std, w = fit_logistic(x, y)
+    prob = 1 / (1 + np.exp(-(w[0] + ((x - mean) / std) @ w[1:])))
+    no_below, strong_above = pick_thresholds(prob, y, target_precision, min_samples)
+    return {
+        "features": FEATURES,
+        "mean": mean.tolist(),
+        "std": std.tolist(),
+        "intercept": float(w[0]),
+        "coef": w[1:].tolist(),
+        "no_below": no_below,
+        "strong_above": strong_above,
+        "target_precision": target_precision,
+        "fitted_at": datetime.datetime.now().isoformat(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default="./logs/query_log.jsonl")
+    parser.add_argument("--output", default="./data/support_gate.json")
+    parser.add_argument("--target-precision", type=float, default=0.95)
+    parser.add_argument("--min-samples", type=int, default=20, help="smallest band the gate may decide")
+    parser.add_argument("--holdout", type=float, default=0.2, help="most recent share of samples kept for evaluation")
+    args = parser.parse_args()
+
+    from log_sink import read_log_entries
+    entries = read_log_entries(args.log)
+    samples = labeled_queries(entries)
+
+    # Older entries only have the queries; retrieve them again to get their scores
+    import backend
+    backend.initialize_components()
+    queries = [q for q, _ in samples if isinstance(q, str)]
+    scores = dict(zip(queries, (s for _, _, s in backend.retrieve_contexts_batch(queries))))
+    features = [scores[q] if isinstance(q, str) else q for q, _ in samples]
+    labels = [label for _, label in samples]
+
+    split = int(len(samples) * (1 - args.holdout))
+    params = fit_support_gate(features[:split], labels[:split], args.target_precision, args.min_samples)
+    params["train"] = evaluate(params, features[:split], labels[:split])
+    params["holdout"] = evaluate(params, features[split:], labels[split:])
+    print(json.dumps(params, indent=2))
+
+    # Final thresholds use every sample
+    final = fit_support_gate(features, labels, args.target_precision, args.min_samples)
+    final.update({"train": params["train"], "holdout": params["holdout"]})
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(final, f, indent=2)
+    print(f"Saved support gate to {args.output}")
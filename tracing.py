@@ -0,0 +1,162 @@
+"""
+Per-stage spans for the answer pipeline.
+
+Each span records the wall time of one stage and, for LLM calls, the model, prompt and
+completion tokens and their cost. Spans of a request are collected on its Trace (written into
+the query log entry) and every span also feeds the process-wide `metrics` histograms.
+
+Summarize the spans in a query log:
+    python tracing.py --log ./logs/query_log.jsonl
+"""
+import time
+import json
+import asyncio
+import argparse
+import threading
+import contextvars
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class Trace:
+    """The spans of one request; `start` is shared by speculative work so offsets line up."""
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.spans = []
+
+
+# Trace of the request being processed
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class StageMetrics:
+    """Process-wide latency histograms (over the last `window` spans) and token/cost totals per stage."""
+
+    def __init__(self, prices=None, window=10000):
+        self.prices = dict(prices or {})  # model -> USD per million (prompt, completion) tokens
+        self.window = window
+        self._lock = threading.Lock()
+        self._seconds = defaultdict(lambda: deque(maxlen=self.window))
+        self._totals = defaultdict(lambda: defaultdict(float))
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        if model not in self.prices or prompt_tokens is None:
+            return None
+        prompt_price, completion_price = self.prices[model]
+        return (prompt_tokens * prompt_price + (completion_tokens or 0) * completion_price) / 1e6
+
+    def record(self, record):
+        with self._lock:
+            stage = record["stage"]
+            self._seconds[stage].append(record["seconds"])
+            totals = self._totals[stage]
+            totals["count"] += 1
+            totals["errors"] += record["status"] == "error"
+            totals["cancelled"] += record["status"] == "cancelled"
+            for key in ("prompt_tokens", "completion_tokens", "cost_usd"):
+                totals[key] += record.get(key) or 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {**summarize(list(seconds)), **self._totals[stage]}
+                for stage, seconds in self._seconds.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._seconds.clear()
+            self._totals.clear()
+
+
+def summarize(seconds):
+    if not seconds:
+        return {}
+    values = np.percentile(seconds, PERCENTILES)
+    summary = {f"p{p}": round(float(v), 4) for p, v in zip(PERCENTILES, values)}
+    summary["mean"] = round(float(np.mean(seconds)), 4)
+    return summary
+
+
+metrics = StageMetrics()
+
+
+@contextmanager
+def span(stage, model=None):
+    """Time the enclosed block as `stage`; the yielded record can be given token usage."""
+    record = {
+        "stage": stage,
+        "model": model,
+        "offset": None,
+        "seconds": None,
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "cost_usd": None,
+        "status": "ok",
+    }
+    start = time.perf_counter()
+    try:
+        yield record
+    except asyncio.CancelledError:
+        record["status"] = "cancelled"
+        raise
+    except Exception:
+        record["status"] = "error"
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        record["cost_usd"] = metrics.cost(model, record["prompt_tokens"], record["completion_tokens"])
+        trace = current_trace.get()
+        if trace is not None:
+            record["offset"] = round(start - trace.start, 4)
+            trace.spans.append(record)
+        metrics.record(record)
+
+
+def set_usage(record, message):
+    """Copy token usage from a chat model response (or the sum of streamed chunks)."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        record["prompt_tokens"] = (record["prompt_tokens"] or 0) + usage.get("input_tokens", 0)
+        record["completion_tokens"] = (record["completion_tokens"] or 0) + usage.get("output_tokens", 0)
+
+
+def stage_summary(entries):
+    """Per-stage histograms and totals over the spans logged in query log entries."""
+    seconds, totals = defaultdict(list), defaultdict(lambda: defaultdict(float))
+    for entry in entries:
+        for record in entry.get("spans") or []:
+            stage = record["stage"]
+            seconds[stage].append(record["seconds"])
+            totals[stage]["count"] += 1
+            for key in ("prompt_tokens", "completion_tokens", "cost_usd"):
+                totals[stage][key] += record.get(key) or 0
+    return {stage: {**summarize(values), **totals[stage]} for stage, values in seconds.items()}
+
+
+def format_summary(summary):
+    lines = [
+        f"{'stage':<20} {'count':>7} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'prompt tok':>11} {'compl tok':>10} {'cost $':>9}"
+    ]
+    for stage, s in sorted(summary.items(), key=lambda item: -item[1].get("p50", 0)):
+        lines.append(
+            f"{stage:<20} {int(s['count']):>7} {s.get('p50', 0):>8.3f} {s.get('p95', 0):>8.3f} {s.get('p99', 0):>8.3f} "
+            f"{int(s['prompt_tokens']):>11} {int(s['completion_tokens']):>10} {s['cost_usd']:>9.4f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default="./logs/query_log.jsonl")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    from log_sink import read_log_entries
+    summary = stage_summary(read_log_entries(args.log))
+    print(json.dumps(summary, indent=2) if args.json else format_summary(summary))
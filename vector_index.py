@@ -0,0 +1,353 @@
+"""
+Build approximate-nearest-neighbor (HNSW / IVF-Flat) variants of the FAISS vectorstore.
+
+The chunks come from the chunk pickle. Their vectors are read back from the existing flat
+index, so only chunks that are not in it yet are embedded. The result is saved with
+FAISS.save_local, so pointing CHATDBG_INDEX at the output folder is enough to serve it:
+efSearch / nprobe are stored inside the index and FAISS.load_local restores them.
+
+Run from the repository root, e.g.:
+    python vector_index.py --kind hnsw --m 32 --ef-search 64 --output faiss_index_openai_3textlarge_hnsw
+    python vector_index.py --kind ivf --nprobe 16 --output faiss_index_openai_3textlarge_ivf
+
+Both print (and with --report save) a recall@10 vs. latency table against the flat index.
+The report queries are the questions in the query log (embedded through the embedding cache,
+which already holds them). If the log has too few, chunk vectors are held out of the evaluated
+indexes and used as queries instead, so that no query finds itself.
+
+To save memory, the first-pass index can hold truncated (Matryoshka-style, --dims) and/or
+float16 / int8 (--precision) vectors. The full float32 vectors are then saved next to it as
+full_vectors.npy. At load time attach_reranking memory-maps that file and re-ranks the top
+--candidates hits exactly:
+    python vector_index.py --kind flat --dims 512 --precision int8 --compression-sweep \
+        --output faiss_index_openai_3textlarge_512_int8
+"""
+import os
+import json
+import time
+import argparse
+
+import faiss
+import numpy as np
+import pandas as pd
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_openai import OpenAIEmbeddings
+
+DEFAULT_FLAT_INDEX = "faiss_index_openai_3textlarge_copy"
+DEFAULT_CHUNKS = "./data/combined_chunks.pkl"
+DEFAULT_QUERY_LOG = "./logs/query_log.jsonl"
+DEFAULT_EMBEDDING_CACHE = "./cache/embedding_cache.sqlite"
+COMPRESSION_FILE = "compression.json"
+FULL_VECTORS_FILE = "full_vectors.npy"
+
+SCALAR_QUANTIZERS = {
+    "float32": None,
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def collect_vectors(flat_vectorstore, chunks, embedding_model, batch_size=100):
+    """float32 matrix of chunk vectors in chunk order, reusing the flat index's vectors."""
+    row_by_idx = {}
+    for row, doc_id in flat_vectorstore.index_to_docstore_id.items():
+        row_by_idx[flat_vectorstore.docstore.search(doc_id).metadata["idx"]] = row
+
+    vectors = np.zeros((len(chunks), flat_vectorstore.index.d), dtype=np.float32)
+    missing = []
+    for pos, chunk in enumerate(chunks):
+        row = row_by_idx.get(chunk.metadata["idx"])
+        if row is None:
+            missing.append(pos)
+        else:
+            vectors[pos] = flat_vectorstore.index.reconstruct(row)
+
+    if missing:
+        print(f"Embedding {len(missing)} chunks that are not in the flat index")
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        embedded = embedding_model.embed_documents([chunks[pos].page_content for pos in batch])
+        vectors[batch] = np.array(embedded, dtype=np.float32)
+    return vectors
+
+
+def reduce_vectors(vectors, dims=None):
+    """First `dims` components, re-normalized to unit length (Matryoshka truncation)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dims is None or dims >= vectors.shape[1]:
+        return vectors
+    reduced = np.array(vectors[:, :dims], dtype=np.float32, order="C", copy=True)
+    faiss.normalize_L2(reduced)
+    return reduced
+
+
+def set_search_params(index, ef_search=None, nprobe=None):
+    # Both are saved with the index by faiss.write_index
+    index = getattr(index, "base", index)
+    if ef_search is not None:
+        faiss.downcast_index(index).hnsw.efSearch = ef_search
+    if nprobe is not None:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+
+
+def build_ann_index(vectors, kind, metric=faiss.METRIC_L2, m=32, ef_construction=200,
+                    ef_search=64, nlist=None, nprobe=16, precision="float32"):
+    d = vectors.shape[1]
+    qtype = SCALAR_QUANTIZERS[precision]
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, m, metric) if qtype is None else faiss.IndexHNSWSQ(d, qtype, m, metric)
+        index.hnsw.efConstruction = ef_construction
+        set_search_params(index, ef_search=ef_search)
+    elif kind == "ivf":
+        nlist = nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        quantizer = faiss.IndexFlat(d, metric)
+        index = faiss.IndexIVFFlat(quantizer, d, nlist, metric) if qtype is None \
+            else faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, qtype, metric)
+        set_search_params(index, nprobe=nprobe)
+    elif kind == "flat":
+        index = faiss.IndexFlat(d, metric) if qtype is None else faiss.IndexScalarQuantizer(d, qtype, metric)
+    else:
+        raise ValueError(f"Unknown index kind: {kind}")
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def index_megabytes_per_million(index):
+    return faiss.serialize_index(index).nbytes / index.ntotal * 1e6 / 2 ** 20
+
+
+class RerankingIndex:
+    """
+    First-pass search on a reduced index, re-ranked with the full float32 vectors.
+
+    Stands in for the faiss index inside the FAISS vectorstore (search, reconstruct, d,
+    ntotal), so similarity search and backend.search_vectors work unchanged. Read-only.
+    """
+
+    def __init__(self, base, full_vectors, dims=None, candidates=50):
+        self.base = base
+        self.full_vectors = full_vectors
+        self.dims = dims
+        self.candidates = candidates
+        self.d = full_vectors.shape[1]
+        self.ntotal = base.ntotal
+        self.metric_type = base.metric_type
+
+    def reconstruct(self, i):
+        return np.array(self.full_vectors[i], dtype=np.float32)
+
+    def search(self, x, k):
+        x = np.asarray(x, dtype=np.float32)
+        _, candidates = self.base.search(reduce_vectors(x, self.dims), max(k, self.candidates))
+        inner_product = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        distances = np.full((len(x), k), -np.inf if inner_product else np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        for i, (query, rows) in enumerate(zip(x, candidates)):
+            # Sorted rows read the memory map in file order
+            rows = np.sort(rows[rows != -1])
+            full = self.full_vectors[rows]
+            if inner_product:
+                scores = full @ query
+                order = np.argsort(-scores, kind="stable")[:k]
+            else:
+                scores = ((full - query) ** 2).sum(axis=1)
+                order = np.argsort(scores, kind="stable")[:k]
+            distances[i, :len(order)] = scores[order]
+            labels[i, :len(order)] = rows[order]
+        return distances, labels
+
+
+def save_full_vectors(path, vectors, dims, precision, candidates):
+    np.save(os.path.join(path, FULL_VECTORS_FILE), np.asarray(vectors, dtype=np.float32))
+    with open(os.path.join(path, COMPRESSION_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "dims": dims,
+            "precision": precision,
+            "candidates": candidates,
+            "full_dims": int(vectors.shape[1]),
+        }, f, indent=2)
+
+
+def attach_reranking(vectorstore, path):
+    """If the index at `path` was saved compressed, re-rank its hits with the memory-mapped full vectors."""
+    config_path = os.path.join(path, COMPRESSION_FILE)
+    if not os.path.exists(config_path):
+        return vectorstore
+    with open(config_path, encoding="utf-8") as f:
+        config = json.load(f)
+    full_vectors = np.load(os.path.join(path, FULL_VECTORS_FILE), mmap_mode="r")
+    vectorstore.index = RerankingIndex(vectorstore.index, full_vectors, config["dims"], config["candidates"])
+    return vectorstore
+
+
+def save_vectorstore(index, chunks, embedding_model, path):
+    """Save `index` (rows in chunk order) with the chunks as a FAISS.load_local-compatible folder."""
+    ids = [str(chunk.metadata["idx"]) for chunk in chunks]
+    vectorstore = FAISS(
+        embedding_function=embedding_model,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, chunks))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+    vectorstore.save_local(path)
+    return vectorstore
+
+
+def logged_query_vectors(log_path, embedding_model, cache_path, limit, rng):
+    """Vectors of up to `limit` distinct questions (and rephrased variants) from the query log."""
+    from log_sink import read_log_entries
+    from embedding_cache import CachedEmbeddings
+
+    texts = set()
+    for entry in read_log_entries(log_path):
+        texts.add(entry.get("original_query"))
+        texts.update(entry.get("rephrased_queries") or [])
+    texts = sorted(t for t in texts if t and t.strip())
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    if len(texts) > limit:
+        texts = [texts[i] for i in rng.choice(len(texts), size=limit, replace=False)]
+    cached = CachedEmbeddings(embedding_model, cache_path)
+    return np.array(cached.embed_documents(texts), dtype=np.float32)
+
+
+def recall_at_k(exact_ids, approx_ids, k):
+    hits = [len(set(e[:k]) & set(a[:k])) for e, a in zip(exact_ids, approx_ids)]
+    return sum(hits) / (k * len(exact_ids))
+
+
+def time_searches(index, queries, k):
+    latencies, ids = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, found = index.search(q[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        ids.append(found[0])
+    return np.array(latencies) * 1000, ids
+
+
+def recall_latency_report(flat_index, ann_index, queries, kind, sweep, k=10):
+    """Markdown table of recall@k and per-query latency for each efSearch / nprobe in `sweep`."""
+    flat_ms, exact_ids = time_searches(flat_index, queries, k)
+    param = {"hnsw": "efSearch", "ivf": "nprobe"}.get(kind, "-")
+    lines = [
+        f"| index | {param} | recall@{k} | p50 ms | p95 ms |",
+        "|---|---|---|---|---|",
+        f"| flat | - | 1.000 | {np.percentile(flat_ms, 50):.3f} | {np.percentile(flat_ms, 95):.3f} |",
+    ]
+    for value in sweep:
+        set_search_params(ann_index, **({"ef_search": value} if kind == "hnsw" else {"nprobe": value}))
+        ms, approx_ids = time_searches(ann_index, queries, k)
+        lines.append(
+            f"| {kind} | {'-' if value is None else value} | {recall_at_k(exact_ids, approx_ids, k):.3f} | "
+            f"{np.percentile(ms, 50):.3f} | {np.percentile(ms, 95):.3f} |"
+        )
+    return "\n".join(lines)
+
+
+def compression_report(vectors, queries, metric, dims_options, precisions, candidates, k=10):
+    """
+    Markdown table of first-pass memory and recall@k for flat indexes over reduced vectors,
+    before and after re-ranking `candidates` hits with the full vectors.
+    """
+    exact = build_ann_index(vectors, "flat", metric=metric)
+    _, exact_ids = exact.search(queries, k)
+    lines = [
+        f"| dims | precision | MB per 1M chunks | recall@{k} first pass | recall@{k} re-ranked | "
+        f"delta vs. flat | p50 ms |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for dims in dims_options:
+        reduced = reduce_vectors(vectors, dims)
+        for precision in precisions:
+            base = build_ann_index(reduced, "flat", metric=metric, precision=precision)
+            _, first_ids = base.search(reduce_vectors(queries, dims), k)
+            ms, reranked_ids = time_searches(RerankingIndex(base, vectors, dims, candidates), queries, k)
+            first_recall = recall_at_k(exact_ids, first_ids, k)
+            reranked_recall = recall_at_k(exact_ids, reranked_ids, k)
+            lines.append(
+                f"| {reduced.shape[1]} | {precision} | {index_megabytes_per_million(base):.0f} | "
+                f"{first_recall:.3f} | {reranked_recall:.3f} | {reranked_recall - 1:+.3f} | "
+                f"{np.percentile(ms, 50):.3f} |"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=["hnsw", "ivf", "flat"], required=True)
+    parser.add_argument("--flat-index", default=DEFAULT_FLAT_INDEX)
+    parser.add_argument("--chunks", default=DEFAULT_CHUNKS)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--m", type=int, default=32, help="HNSW neighbors per node")
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default 4 * sqrt(N))")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--dims", type=int, default=None, help="truncate the first-pass vectors to this many dimensions")
+    parser.add_argument("--precision", choices=list(SCALAR_QUANTIZERS), default="float32")
+    parser.add_argument("--candidates", type=int, default=50, help="first-pass hits re-ranked with the full vectors")
+    parser.add_argument("--compression-sweep", action="store_true",
+                        help="add a memory / recall table for 256-3072 dims x float32/float16/int8")
+    parser.add_argument("--eval-queries", type=int, default=500, help="queries used for the report")
+    parser.add_argument("--query-log", default=DEFAULT_QUERY_LOG, help="logged questions are the report queries")
+    parser.add_argument("--embedding-cache", default=DEFAULT_EMBEDDING_CACHE)
+    parser.add_argument("--min-logged-queries", type=int, default=100,
+                        help="below this many logged questions, held-out chunk vectors are used instead")
+    parser.add_argument("--report", default=None, help="also write the report to this markdown file")
+    args = parser.parse_args()
+
+    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large")
+    flat = FAISS.load_local(args.flat_index, embedding_model, allow_dangerous_deserialization=True)
+    chunks = list(pd.read_pickle(args.chunks))
+    vectors = collect_vectors(flat, chunks, embedding_model)
+
+    compressed = args.dims is not None or args.precision != "float32"
+    start = time.perf_counter()
+    index = build_ann_index(
+        reduce_vectors(vectors, args.dims), args.kind, metric=flat.index.metric_type, m=args.m,
+        ef_construction=args.ef_construction, ef_search=args.ef_search, nlist=args.nlist, nprobe=args.nprobe,
+        precision=args.precision
+    )
+    print(f"Built {args.kind} index over {index.ntotal} vectors in {time.perf_counter() - start:.1f}s "
+          f"({index_megabytes_per_million(index):.0f} MB per million chunks)")
+    search_index = RerankingIndex(index, vectors, args.dims, args.candidates) if compressed else index
+
+    # A chunk vector used as a query finds itself, which inflates recall compared to real traffic
+    rng = np.random.default_rng(0)
+    queries = logged_query_vectors(args.query_log, embedding_model, args.embedding_cache, args.eval_queries, rng)
+    eval_vectors, eval_index = vectors, search_index
+    if len(queries) < args.min_logged_queries:
+        held_out = rng.choice(len(vectors), size=min(args.eval_queries, len(vectors) // 10), replace=False)
+        print(f"Only {len(queries)} logged queries; evaluating with {len(held_out)} held-out chunk vectors")
+        queries = vectors[held_out]
+        eval_vectors = np.delete(vectors, held_out, axis=0)
+        eval_index = build_ann_index(
+            reduce_vectors(eval_vectors, args.dims), args.kind, metric=flat.index.metric_type, m=args.m,
+            ef_construction=args.ef_construction, ef_search=args.ef_search, nlist=args.nlist, nprobe=args.nprobe,
+            precision=args.precision
+        )
+        if compressed:
+            eval_index = RerankingIndex(eval_index, eval_vectors, args.dims, args.candidates)
+    exact = build_ann_index(eval_vectors, "flat", metric=flat.index.metric_type)
+    sweep = {"hnsw": [16, 32, 64, 128, 256], "ivf": [1, 4, 16, 64, 128]}.get(args.kind, [None])
+    report = recall_latency_report(exact, eval_index, queries, args.kind, sweep)
+    if args.compression_sweep:
+        report += "\n\n" + compression_report(
+            eval_vectors, queries, flat.index.metric_type, [256, 512, 1024, None], list(SCALAR_QUANTIZERS), args.candidates
+        )
+    print(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(f"# {args.kind} vs. flat ({len(eval_vectors)} chunks, {len(queries)} queries)\n\n{report}\n")
+
+    # The sweep changed the search parameter; save with the one that was asked for
+    set_search_params(index, ef_search=args.ef_search if args.kind == "hnsw" else None,
+                      nprobe=args.nprobe if args.kind == "ivf" else None)
+    save_vectorstore(index, chunks, embedding_model, args.output)
+    if compressed:
+        save_full_vectors(args.output, vectors, args.dims, args.precision, args.candidates)
+    print(f"Saved to {args.output}; set CHATDBG_INDEX={args.output} to use it")